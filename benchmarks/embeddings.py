@@ -0,0 +1,60 @@
+"""
+Compares the lookup-table tokenization, one-hot encoding and the cached positional encoding in :mod:`proteinshake.utils.embeddings` with the previous per-residue implementations.
+
+    $ python benchmarks/embeddings.py --length 500
+"""
+
+import timeit
+import argparse
+import numpy as np
+
+from proteinshake.utils import embeddings
+from proteinshake.utils.embeddings import residue_alphabet, atom_alphabet
+
+
+def reference_onehot(sequence, resolution='residue'):
+    if resolution == 'residue':
+        return np.stack([np.eye(len(residue_alphabet))[residue_alphabet.index(aa)] for aa in sequence])
+    else:
+        return np.stack([np.eye(len(atom_alphabet))[atom_alphabet.index(aa[0])] for aa in sequence])
+
+def reference_tokenize(sequence, resolution='residue'):
+    if resolution == 'residue':
+        return np.array([residue_alphabet.index(aa) for aa in sequence])
+    else:
+        return np.array([atom_alphabet.index(aa[0]) for aa in sequence])
+
+def reference_positional_encoding(sequence, dim=128):
+    def cal_angle(position, hid_idx):
+        return position / np.power(10000, 2 * (hid_idx // 2) / dim)
+    def get_posi_angle_vec(position):
+        return [cal_angle(position, hid_j) for hid_j in range(dim)]
+    sinusoid_table = np.array([get_posi_angle_vec(pos_i) for pos_i in range(len(sequence))])
+    sinusoid_table[:, 0::2] = np.sin(sinusoid_table[:, 0::2])
+    sinusoid_table[:, 1::2] = np.cos(sinusoid_table[:, 1::2])
+    return sinusoid_table
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--length', type=int, default=300)
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+    residues = list(rng.choice(list(residue_alphabet), args.length))
+    atoms = list(rng.choice(['N', 'CA', 'C', 'O', 'CB', 'OG1', 'SD', 'NZ'], 8 * args.length))
+    cases = [
+        ('tokenize residue', reference_tokenize, embeddings.tokenize, (residues,)),
+        ('tokenize atom', reference_tokenize, embeddings.tokenize, (atoms, 'atom')),
+        ('onehot residue', reference_onehot, embeddings.onehot, (residues,)),
+        ('onehot atom', reference_onehot, embeddings.onehot, (atoms, 'atom')),
+        ('positional_encoding', reference_positional_encoding, embeddings.positional_encoding, (residues,)),
+    ]
+    print(f'{args.length} residues, {len(atoms)} atoms')
+    for name, reference, function, arguments in cases:
+        assert np.allclose(reference(*arguments), function(*arguments))
+        before = timeit.timeit(lambda: reference(*arguments), number=args.repeats) / args.repeats
+        after = timeit.timeit(lambda: function(*arguments), number=args.repeats) / args.repeats
+        print(f'{name:>20}: {before*1000:8.2f} ms -> {after*1000:6.3f} ms ({before/after:6.1f}x)')
+
+if __name__ == '__main__':
+    main()
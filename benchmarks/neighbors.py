@@ -0,0 +1,49 @@
+"""
+Compares the graph construction of :mod:`proteinshake.utils.neighbors` with scikit-learn across protein sizes.
+
+    $ python benchmarks/neighbors.py --sizes 100 1000 10000 50000 --eps 8 --k 16
+"""
+
+import time
+import argparse
+import numpy as np
+from sklearn.neighbors import radius_neighbors_graph, kneighbors_graph
+
+from proteinshake.utils.neighbors import radius_graph, knn_graph
+
+
+def random_protein(n, seed=0):
+    """ Points in a sphere with the density of the atoms of a globular protein. """
+    rng = np.random.default_rng(seed)
+    direction = rng.normal(size=(n, 3))
+    radius = 1.5 * 2.2 * n**0.38 * rng.uniform(size=(n, 1))**(1/3)
+    return radius * direction / np.linalg.norm(direction, axis=1, keepdims=True)
+
+def measure(fx, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = fx()
+    return result, (time.perf_counter() - start) / repeats
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 30000])
+    parser.add_argument('--eps', type=float, default=8)
+    parser.add_argument('--k', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=-1)
+    args = parser.parse_args()
+    for n in args.sizes:
+        coords = random_protein(n)
+        repeats = max(1, 1000 // n)
+        cases = [
+            (f'eps={args.eps}', lambda: radius_neighbors_graph(coords, radius=args.eps, mode='distance'), lambda: radius_graph(coords, args.eps, weighted=True)),
+            (f'k={args.k}', lambda: kneighbors_graph(coords, n_neighbors=args.k, mode='distance'), lambda: knn_graph(coords, args.k, weighted=True, workers=args.workers)),
+        ]
+        for name, reference, function in cases:
+            expected, before = measure(reference, repeats)
+            result, after = measure(function, repeats)
+            assert abs(expected - result).max() < 1e-9 and (expected != 0).nnz == (result != 0).nnz
+            print(f'{n:>7} points {name:>8}: sklearn {before*1000:9.2f} ms, kd-tree {after*1000:8.2f} ms ({before/after:5.1f}x)')
+
+if __name__ == '__main__':
+    main()
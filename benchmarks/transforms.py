@@ -0,0 +1,53 @@
+"""
+Times the coordinate transforms on array-native proteins against the previous implementation, which converted the coordinate lists to an array and back for every transform, and the batched transforms on a packed batch against a loop over the proteins.
+
+    $ python benchmarks/transforms.py --length 2000 --batch_size 256
+"""
+
+import copy
+import timeit
+import argparse
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+from proteinshake.transforms import Compose, CenterTransform, RandomRotateTransform, pack_coords
+
+
+def reference_center(protein):
+    coords = np.array([protein['atom']['x'], protein['atom']['y'], protein['atom']['z']]).T
+    coords = coords - coords.mean(axis=0)
+    protein['atom']['x'], protein['atom']['y'], protein['atom']['z'] = (list(map(float, coords[:,i])) for i in range(3))
+    return protein
+
+def reference_rotate(protein):
+    coords = np.array([protein['atom']['x'], protein['atom']['y'], protein['atom']['z']]).T
+    coords = Rotation.random().apply(coords)
+    protein['atom']['x'], protein['atom']['y'], protein['atom']['z'] = (list(map(float, coords[:,i])) for i in range(3))
+    return protein
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--length', type=int, default=2000)
+    parser.add_argument('--repeats', type=int, default=50)
+    parser.add_argument('--batch_size', type=int, default=256)
+    args = parser.parse_args()
+    coords = np.random.default_rng(0).normal(size=(args.length, 3)) * 20
+    protein = {'protein': {'ID': 'benchmark'}, 'atom': {'x': coords[:,0].tolist(), 'y': coords[:,1].tolist(), 'z': coords[:,2].tolist()}}
+    transform = Compose([CenterTransform(resolution='atom'), RandomRotateTransform(resolution='atom')])
+    reference = lambda p: reference_rotate(reference_center(p))
+    # the first call converts the lists to an array, later calls transform the array in place
+    for name, fx in [('lists', reference), ('array', transform)]:
+        proteins = [copy.deepcopy(protein) for _ in range(args.repeats)]
+        first = timeit.timeit(lambda: fx(proteins.pop()), number=args.repeats) / args.repeats
+        p = fx(copy.deepcopy(protein))
+        again = timeit.timeit(lambda: fx(p), number=args.repeats) / args.repeats
+        print(f'{name}: {first*1000:7.3f} ms first call, {again*1000:7.3f} ms repeated calls')
+    proteins = [copy.deepcopy(protein) for _ in range(args.batch_size)]
+    loop = timeit.timeit(lambda: [transform(p) for p in proteins], number=10) / 10
+    coords, ptr = pack_coords(proteins, resolution='atom')
+    keys = list(range(args.batch_size))
+    batch = timeit.timeit(lambda: transform.batch(coords, ptr, keys=keys), number=10) / 10
+    print(f'batch of {args.batch_size}: {loop*1000:7.3f} ms loop, {batch*1000:7.3f} ms batched')
+
+if __name__ == '__main__':
+    main()
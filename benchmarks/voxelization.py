@@ -0,0 +1,81 @@
+"""
+Compares the scatter-based voxelization of :class:`proteinshake.representations.voxel.Voxel` with the previous dense implementation, which allocated a (grid x atoms x channels) array.
+
+    $ python benchmarks/voxelization.py --n_atoms 5000 --voxelsize 2
+"""
+
+import time
+import argparse
+import tracemalloc
+import numpy as np
+
+from proteinshake.representations.voxel import Voxel
+from proteinshake.utils import onehot, residue_alphabet
+
+
+def dense_voxelize(protein, gridsize, voxelsize, aggregation):
+    """ The previous implementation, for reference.
+    """
+    labels = onehot(protein['residue']['residue_type'])
+    coords = np.stack([protein['residue']['x'], protein['residue']['y'], protein['residue']['z']], axis=1)
+    coords -= coords.min(axis=0)
+    voxel_indices = (coords / voxelsize).astype(np.int32)
+    voxels = np.zeros(shape=np.concatenate([voxel_indices.max(axis=0)+1, labels.shape]))
+    counts = np.zeros(shape=np.concatenate([voxel_indices.max(axis=0)+1, labels.shape]))
+    voxel_indices = np.concatenate([voxel_indices, np.expand_dims(np.arange(len(coords)),1)], axis=1)
+    voxels[tuple(voxel_indices.transpose())] = labels
+    if aggregation == 'sum':
+        voxels = voxels.sum(axis=-2)
+    elif aggregation == 'mean':
+        counts[tuple(voxel_indices.transpose())] = np.ones_like(labels)
+        counts = counts.sum(axis=-2)
+        voxels = np.divide(voxels.sum(axis=-2), counts, out=np.zeros_like(counts), where=counts!=0)
+    diff = gridsize-voxels.shape[:-1]
+    lower = -((diff < 0) * np.ceil(diff/2)).astype(int)
+    upper = (voxels.shape[:-1] * (diff >= 0) + (diff < 0) * np.floor(diff/2)).astype(int)
+    voxels = voxels[lower[0]:upper[0],lower[1]:upper[1],lower[2]:upper[2]]
+    diff = gridsize-voxels.shape[:-1]
+    paddings = np.stack([np.ceil(diff/2), np.floor(diff/2)],1).astype(np.int32)
+    return np.pad(voxels, (*paddings,(0,0)))
+
+def random_protein(n, seed=0):
+    rng = np.random.default_rng(seed)
+    # points in a sphere with the density of a globular protein
+    direction = rng.normal(size=(n, 3))
+    radius = 2.2 * n**0.38 * rng.uniform(size=(n, 1))**(1/3)
+    coords = radius * direction / np.linalg.norm(direction, axis=1, keepdims=True)
+    return {'residue': {
+        'residue_type': ''.join(rng.choice(list(residue_alphabet), n)),
+        'x': coords[:,0], 'y': coords[:,1], 'z': coords[:,2],
+    }}
+
+def measure(fx):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fx()
+    duration = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, duration, peak
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_atoms', type=int, default=500)
+    parser.add_argument('--voxelsize', type=float, default=2)
+    parser.add_argument('--aggregation', default='mean')
+    args = parser.parse_args()
+    protein = random_protein(args.n_atoms)
+    coords = np.stack([protein['residue'][c] for c in 'xyz'], axis=1)
+    gridsize = np.ceil(np.ptp(coords, axis=0) / args.voxelsize).astype(int)
+    print(f'{args.n_atoms} points, grid {gridsize.tolist()}, voxelsize {args.voxelsize}')
+    scatter, scatter_time, scatter_peak = measure(lambda: Voxel(protein, gridsize, args.voxelsize, args.aggregation).data)
+    try:
+        dense, dense_time, dense_peak = measure(lambda: dense_voxelize(protein, gridsize, args.voxelsize, args.aggregation))
+        assert np.allclose(dense, scatter)
+        print(f'dense:   {dense_time*1000:8.1f} ms {dense_peak/2**20:10.1f} MiB peak')
+    except MemoryError:
+        print('dense:   out of memory')
+    print(f'scatter: {scatter_time*1000:8.1f} ms {scatter_peak/2**20:10.1f} MiB peak')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+"""
+Command line interface, see ``python -m proteinshake --help``.
+"""
+
+import time
+import argparse
+
+from proteinshake.utils.cache import CacheManager, format_size
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python -m proteinshake', description='ProteinShake command line tools.')
+    subparsers = parser.add_subparsers(dest='tool', required=True)
+    cache_parser = subparsers.add_parser('cache', help='List and prune the processed representations.')
+    commands = cache_parser.add_subparsers(dest='command', required=True)
+    list_parser = commands.add_parser('list', help='List the entries, least recently used first.')
+    list_parser.add_argument('root', help='The processed directory, e.g. data/processed.')
+    prune_parser = commands.add_parser('prune', help='Remove the least recently used entries until the budget is met.')
+    prune_parser.add_argument('root', help='The processed directory, e.g. data/processed.')
+    prune_parser.add_argument('--budget', required=True, help='The disk budget, e.g. 50G.')
+    args = parser.parse_args(args)
+    cache = CacheManager(args.root)
+    if args.command == 'list':
+        entries = cache.list()
+        for entry in entries:
+            print(f'{format_size(entry["size"]):>10}  {time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["last_access"]))}  {entry["path"]}')
+        print(f'{format_size(sum(entry["size"] for entry in entries)):>10}  total')
+    elif args.command == 'prune':
+        for entry in cache.prune(args.budget):
+            print(f'Removed {entry["path"]} ({format_size(entry["size"])})')
+
+if __name__ == '__main__':
+    main()
@@ -17,7 +17,7 @@ from sklearn.neighbors import kneighbors_graph, radius_neighbors_graph
 from fastavro import reader as avro_reader
 
 from proteinshake.transforms import IdentityTransform, RandomRotateTransform, CenterTransform
-from proteinshake.utils import download_url, save, load, unzip_file, write_avro, Generator, progressbar, warning, error
+from proteinshake.utils import download_url, save, load, unzip_file, write_avro, Generator, progressbar, warning, error, stable_hash
 
 AA_THREE_TO_ONE = {'ALA': 'A', 'CYS': 'C', 'ASP': 'D', 'GLU': 'E', 'PHE': 'F', 'GLY': 'G', 'HIS': 'H', 'ILE': 'I', 'LYS': 'K', 'LEU': 'L', 'MET': 'M', 'ASN': 'N', 'PRO': 'P', 'GLN': 'Q', 'ARG': 'R', 'SER': 'S', 'THR': 'T', 'VAL': 'V', 'TRP': 'W', 'TYR': 'Y'}
 AA_ONE_TO_THREE = {v:k for k, v in AA_THREE_TO_ONE.items()}
@@ -170,6 +170,21 @@ class Dataset():
     def signature(self):
         return self.compute_signature(use_defaults=False)
 
+    def cache_key(self, transform=None):
+        """ A hash of the dataset signature and the transform applied to the proteins, which identifies the processed representations derived from them.
+
+        Parameters
+        ----------
+        transform: function, default None
+            The transform applied to the proteins before the conversion.
+
+        Returns
+        -------
+        str
+            The cache key.
+        """
+        return stable_hash(self.signature, transform)
+
     def check_signature(self):
         if self.skip_signature_check: return
         if os.path.exists(f'{self.root}/signature.txt'):
@@ -210,7 +225,7 @@ class Dataset():
             with open(f'{self.root}/{self.name}.{resolution}.avro', 'rb') as file:
                 for x in avro_reader(file):
                     yield x
-        return Generator(reader(), total)
+        return Generator(reader, total)
 
     @property
     def limit(self):
@@ -323,8 +338,9 @@ class Dataset():
             print("Centering")
             proteins = [CenterTransform()(p) for p in proteins]
             print("Rotating")
-            seeds = (abs(hash(p['protein']['sequence'])) % 2**28 for p in proteins)
-            proteins = [RandomRotateTransform(seed=seed)(p) for seed, p in zip(seeds, proteins)]
+            # the rotation of every protein is derived from its ID, independent of the process
+            rotate = RandomRotateTransform()
+            proteins = [rotate(p) for p in proteins]
 
         residue_proteins = [{'protein':p['protein'], 'residue':p['residue']} for p in proteins]
         atom_proteins = [{'protein':p['protein'], 'atom':p['atom']} for p in proteins]
@@ -511,10 +527,11 @@ class Dataset():
         """
         from proteinshake.representations import GraphDataset
         proteins = self.proteins(resolution=resolution)
-        return GraphDataset(Generator((transform(p) for p in proteins), len(proteins)),
+        return GraphDataset(Generator(lambda: (transform(p) for p in proteins), len(proteins)),
                             self.root,
                             self.name,
                             resolution,
+                            key = self.cache_key(transform),
                             verbosity = self.verbosity,
                             **kwargs)
 
@@ -528,10 +545,11 @@ class Dataset():
         """
         from proteinshake.representations import PointDataset
         proteins = self.proteins(resolution=resolution)
-        return PointDataset(Generator((transform(p) for p in proteins), len(proteins)),
+        return PointDataset(Generator(lambda: (transform(p) for p in proteins), len(proteins)),
                             self.root,
                             self.name,
                             resolution,
+                            key = self.cache_key(transform),
                             verbosity = self.verbosity,
                             **kwargs)
 
@@ -545,9 +563,10 @@ class Dataset():
         """
         from proteinshake.representations import VoxelDataset
         proteins = self.proteins(resolution=resolution)
-        return VoxelDataset(Generator((transform(p) for p in proteins), len(proteins)),
+        return VoxelDataset(Generator(lambda: (transform(p) for p in proteins), len(proteins)),
                             self.root,
                             self.name,
                             resolution,
+                            key = self.cache_key(transform),
                             verbosity = self.verbosity,
                             **kwargs)
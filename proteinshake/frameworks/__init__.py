@@ -1,5 +1,7 @@
 __all__ = [
     'FrameworkDataset',
+    'Subset',
+    'DynamicBatchSampler',
     'DGLGraphDataset',
     'NumpyVoxelDataset',
     'NumpyPointDataset',
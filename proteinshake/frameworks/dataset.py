@@ -1,5 +1,25 @@
 import os
-from proteinshake.utils import save, load, fx2str, progressbar, error
+import weakref
+import inspect
+import numpy as np
+from joblib import Parallel, delayed
+from proteinshake.utils import save, load, fx2str, stable_hash, progressbar, error, CacheManager
+from proteinshake.frameworks.storage import PickleStorage, PackedStorage, CollatedStorage, LRUCache
+from proteinshake.frameworks.prefetch import Prefetcher
+
+# the datasets which are open in this process, which are never evicted from the cache
+_open_datasets = weakref.WeakSet()
+
+def _n_args(fx):
+    """ Number of positional arguments of a function, or None if it cannot be determined.
+    """
+    try:
+        parameters = inspect.signature(fx).parameters.values()
+    except (TypeError, ValueError):
+        return None
+    if any(p.kind == p.VAR_POSITIONAL for p in parameters):
+        return None
+    return len([p for p in parameters if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)])
 
 class FrameworkDataset():
     """ Dataset base class for different frameworks.
@@ -7,72 +27,308 @@ class FrameworkDataset():
     Parameters
     ----------
     data_list: generator
-        A generator of objects from a representation.
+        A generator of objects from a representation, or of protein dictionaries if `representation` is given.
     size: int
         The size of the dataset.
     path: str
-        Path to save the processed dataset.
+        Path to save the processed dataset. Datasets with a `pre_transform` or `pre_filter` are saved in a subdirectory named by their hash, so several variants can be cached side by side.
     transform: function
         A transform function to be applied in the __getitem__ method. Signature: transform(data, protein_dict) -> (data, protein_dict)
     pre_transform: function
         A transform function to be applied before writing the data. Signature: transform((data, protein_dict)) -> (data, protein_dict)
     pre_filter: function
-        A filter function to be applied before writing the data. Signature: transform(data, protein_dict) -> bool
+        A filter function to be applied before writing the data. Signature: transform(data, protein_dict) -> bool. A filter with the signature filter(protein_dict) -> bool is applied before the conversion, which skips the conversion of discarded proteins.
+    representation: function
+        A function which converts a protein dictionary to a representation object, e.g. a :class:`proteinshake.representations.graph.Graph`. If given, the representation is computed in the conversion workers.
+    n_jobs: int, default 1
+        The number of parallel workers for the conversion. The order of the items is preserved.
+    storage: str, default 'pickle'
+        How the items are stored on disk. 'pickle' writes one file per item, 'packed' writes all items into a few large files with an offset index (recommended for large datasets and network file systems). Some frameworks additionally support 'collated', which concatenates the arrays of all items into a few memory-mapped files.
+    compression: str, default None
+        Per-item compression of the 'packed' storage. Can be None, 'zlib', 'bz2' or 'lzma'.
+    use_mmap: bool, default False
+        If `True`, the 'packed' storage reads items from memory-mapped files.
+    n_threads: int, default 4
+        The number of threads used to decode items when several items are loaded at once, e.g. with an index array.
+    cache_size: int, default 0
+        Size of an in-memory least-recently-used item cache in bytes. 0 disables the cache. Note that transforms should not modify cached items in place.
+    cache_stage: str, default 'raw'
+        Which items to cache. 'raw' caches the items as loaded from disk, 'transformed' caches them after `load_transform` (e.g. densified voxels). The `transform` is never cached.
+    disk_budget: int or str, default None
+        If given, the least recently used processed datasets next to this one (usually in `{root}/processed`) are deleted until their total size is within the budget, e.g. '50G'. Datasets which are open in this process are kept. See :class:`proteinshake.utils.cache.CacheManager`.
     """
 
-    def __init__(self, data_list, size, path, transform=None, pre_transform=None, pre_filter=None, verbosity=2):
+    storages = {
+        'pickle': PickleStorage,
+        'packed': PackedStorage,
+    }
+
+    def __init__(self, data_list, size, path, transform=None, pre_transform=None, pre_filter=None, representation=None, n_jobs=1, storage='pickle', compression=None, use_mmap=False, n_threads=4, cache_size=0, cache_stage='raw', disk_budget=None, verbosity=2):
+        cache_root = os.path.dirname(os.path.dirname(os.path.normpath(path)))
+        if not pre_transform is None or not pre_filter is None:
+            # each combination of pre_transform and pre_filter is stored in its own variant
+            path = f'{path}/variant_{stable_hash(pre_transform, pre_filter)}'
         os.makedirs(path, exist_ok=True)
         self.verbosity = verbosity
         self.path = path
         self.transform = transform
         self.pre_transform = pre_transform
         self.pre_filter = pre_filter
+        self.representation = representation
+        self.storage = self.create_storage(storage, compression=compression, use_mmap=use_mmap)
         transforms_repr = fx2str(pre_transform) + fx2str(pre_filter)
-        if not os.path.exists(f'{path}/{size-1}.pkl'):
-            i = 0
-            for data_item in progressbar(data_list, desc='Converting', total=size, verbosity=self.verbosity):
-                data = self.convert_to_framework(data_item)
-                protein_dict = data_item.protein_dict
-                if not self.pre_filter is None and not self.pre_filter(data, protein_dict):
-                    continue
-                if not self.pre_transform is None:
-                    data, protein_dict = self.pre_transform(data, protein_dict)
-                save((data, protein_dict), f'{path}/{i}.pkl')
-                i += 1
-            save(i,f'{path}/size.pkl')
+        created = not self.storage.exists()
+        if created:
+            if n_jobs == 1:
+                items = map(self.convert_item, data_list)
+            else:
+                items = Parallel(n_jobs=n_jobs, return_as='generator')(delayed(self.convert_item)(x) for x in data_list)
+            items = progressbar(items, desc='Converting', total=size, verbosity=self.verbosity)
+            sizes = []
+            def collect_sizes(items):
+                for item in items:
+                    if not item is None:
+                        sizes.append(self.item_size(*item))
+                        yield item
+            self.storage.write(collect_sizes(items))
+            save({k: np.array([size[k] for size in sizes], dtype=np.int64) for k in (sizes[0] if len(sizes) > 0 else [])}, self.sizes_file)
             save(transforms_repr,f'{path}/transforms.pkl')
-        self.size = load(f'{path}/size.pkl')
+        self.size = len(self.storage)
+        if not cache_stage in ['raw', 'transformed']: error(f'Unknown cache_stage {cache_stage}. Use "raw" or "transformed".', verbosity=self.verbosity)
+        self.cache = LRUCache(cache_size) if cache_size > 0 else None
+        self.cache_stage = cache_stage
+        self.n_threads = n_threads
         original_repr = load(f'{path}/transforms.pkl')
         if not original_repr == transforms_repr: error(f'The pre_transform and/or pre_filter are not the same as when the dataset was created. If you want to change them, delete the folder at {path}', verbosity=self.verbosity)
+        CacheManager.touch(path, size=CacheManager.entry_size(path) if created else None)
+        _open_datasets.add(self)
+        if not disk_budget is None:
+            for entry in CacheManager(cache_root).prune(disk_budget, keep=[dataset.path for dataset in list(_open_datasets)]):
+                if self.verbosity > 0: print(f'Evicted {entry["path"]} from the cache.')
+
+    def create_storage(self, storage, compression=None, use_mmap=False):
+        """ Instantiates the item store of the dataset.
+        """
+        if not storage in self.storages:
+            error(f'Unknown storage {storage}. Use one of {list(self.storages.keys())}.', verbosity=self.verbosity)
+        Storage = self.storages[storage]
+        if issubclass(Storage, PickleStorage):
+            if not compression is None or use_mmap: error('Compression and memory mapping are not available with storage="pickle".', verbosity=self.verbosity)
+            return Storage(self.path)
+        if issubclass(Storage, CollatedStorage):
+            return Storage(self.path, self.to_arrays, self.from_arrays, compression=compression, use_mmap=use_mmap, name=storage)
+        return Storage(self.path, compression=compression, use_mmap=use_mmap)
+
+    def convert_item(self, data_item):
+        """ Computes the representation (if necessary), converts it to the framework and applies `pre_filter` and `pre_transform`. Runs in the conversion workers.
+
+        Returns
+        -------
+        tuple
+            The (data, protein_dict) tuple, or None if the item was filtered.
+        """
+        protein_filter = not self.pre_filter is None and _n_args(self.pre_filter) == 1
+        if not self.representation is None:
+            if protein_filter and not self.pre_filter(data_item):
+                return None
+            data_item = self.representation(data_item)
+        elif protein_filter and not self.pre_filter(data_item.protein_dict):
+            return None
+        data = self.convert_to_framework(data_item)
+        protein_dict = data_item.protein_dict
+        if not self.pre_filter is None and not protein_filter and not self.pre_filter(data, protein_dict):
+            return None
+        if not self.pre_transform is None:
+            data, protein_dict = self.pre_transform(data, protein_dict)
+        return data, protein_dict
 
     def convert_to_framework(self, data_item):
         """ Converts data_item to a data object of the framework.
         """
         return data_item.data
 
+    def to_arrays(self, data):
+        """ Splits a data object into arrays for the 'collated' storage. Returns a dict of arrays which are concatenated along their first axis over the dataset, and a picklable object with everything else.
+        """
+        raise NotImplementedError
+
+    def from_arrays(self, arrays, extras):
+        """ Inverse of `to_arrays`. The arrays are slices of copy-on-write memory maps; converting them without copying keeps the memory shared between processes.
+        """
+        raise NotImplementedError
+
     def load_transform(self, data, protein_dict):
         """ Applies a transform after loading, for example if the data has been stored in sparse format and needs to be converted to dense.
         """
         return data, protein_dict
 
+    def item_size(self, data, protein_dict):
+        """ Computes the size of an item, e.g. to build batches of similar size. Graph datasets additionally report the number of edges.
+
+        Returns
+        -------
+        dict
+            The number of nodes (residues or atoms) of the item.
+        """
+        resolution = 'atom' if 'atom' in protein_dict else 'residue'
+        return {'nodes': len(protein_dict[resolution]['x'])}
+
+    @property
+    def sizes_file(self):
+        """ The file of the sizes index. Datasets whose item sizes depend on load-time parameters use one file per parameter set.
+        """
+        return f'{self.path}/sizes.pkl'
+
+    @property
+    def sizes(self):
+        """ The sizes of all items as computed by :meth:`item_size`, as a dict of arrays. Computed once when the dataset is created.
+        """
+        if not hasattr(self, '_sizes'):
+            if not os.path.exists(self.sizes_file): # datasets created by older versions, or other load-time parameters
+                sizes = [self.item_size(*self.load_item(i)) for i in progressbar(range(self.size), desc='Computing sizes', verbosity=self.verbosity)]
+                save({k: np.array([size[k] for size in sizes], dtype=np.int64) for k in (sizes[0] if len(sizes) > 0 else [])}, self.sizes_file)
+            self._sizes = load(self.sizes_file)
+        return self._sizes
+
+    def cache_info(self):
+        """ Returns the hit and miss statistics of the item cache, or None if caching is disabled.
+        """
+        return None if self.cache is None else self.cache.info()
+
+    def load_item(self, idx):
+        """ Loads an item from the storage (or the cache) and applies `load_transform`.
+        """
+        item = None if self.cache is None else self.cache.get(idx)
+        if item is None:
+            item = self.storage[idx]
+            if not self.cache is None and self.cache_stage == 'raw':
+                self.cache.put(idx, item)
+        elif self.cache_stage == 'transformed':
+            return item
+        item = self.load_transform(*item)
+        if not self.cache is None and self.cache_stage == 'transformed':
+            self.cache.put(idx, item)
+        return item
+
+    def load_items(self, indices):
+        """ Loads several items with one batched read from the storage. Cached items are not read again.
+        """
+        items = [None if self.cache is None else self.cache.get(idx) for idx in indices]
+        missing = [i for i, item in enumerate(items) if item is None]
+        if len(missing) > 0:
+            loaded = self.storage.read_many([indices[i] for i in missing], n_threads=self.n_threads)
+            for i, item in zip(missing, loaded):
+                if not self.cache is None and self.cache_stage == 'raw':
+                    self.cache.put(indices[i], item)
+                items[i] = item
+        missing = set(missing)
+        for i, item in enumerate(items):
+            if i in missing or self.cache_stage == 'raw':
+                items[i] = self.load_transform(*item)
+                if not self.cache is None and self.cache_stage == 'transformed':
+                    self.cache.put(indices[i], items[i])
+        return items
+
     def __len__(self):
         return self.size
 
+    def __getitems__(self, indices):
+        # used by the torch DataLoader to fetch a whole batch at once
+        return self[np.asarray(indices, dtype=np.int64)]
+
     def __getitem__(self, idx):
         try:
             idx = int(idx)
         except:
-            return [self.__getitem__(i) for i in idx]
+            indices = np.asarray(idx)
+            if indices.ndim != 1 or not np.issubdtype(indices.dtype, np.integer):
+                return [self.__getitem__(i) for i in idx]
+            if len(indices) > 0 and indices.max() > self.size - 1:
+                raise StopIteration
+            items = self.load_items(indices.tolist())
+            if not self.transform is None:
+                return [self.transform(item) for item in items]
+            return items
         if idx > self.size - 1:
             raise StopIteration
-        data, protein_dict = self.load_transform(*load(f'{self.path}/{idx}.pkl'))
+        data, protein_dict = self.load_item(idx)
         if not self.transform is None:
             return self.transform((data, protein_dict))
         else:
             return data, protein_dict
 
+    def prefetch(self, depth=8, n_workers=2, backend='thread', ordered=True, chunk_size=1, indices=None):
+        """ Returns an iterator which loads and transforms the next items in the background. See :class:`proteinshake.frameworks.prefetch.Prefetcher` for the parameters.
+        """
+        return Prefetcher(self, indices=indices, depth=depth, n_workers=n_workers, backend=backend, ordered=ordered, chunk_size=chunk_size)
+
     def len(self):
         pass
 
     def get(self):
         pass
+
+
+class Subset():
+    """ A lazy view on a subset of a dataset, e.g. the train split of a task.
+    Items are only loaded from the underlying dataset when they are accessed.
+    Slicing or indexing with an array returns another `Subset`.
+
+    Parameters
+    ----------
+    dataset: FrameworkDataset
+        The dataset to take the subset from.
+    indices: array_like
+        The indices of the items in the subset.
+    chunk_size: int, default 64
+        The number of items that are read at once when iterating.
+    """
+
+    def __init__(self, dataset, indices, chunk_size=64):
+        self.dataset = dataset
+        self.indices = np.asarray(indices)
+        self.chunk_size = chunk_size
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return Subset(self.dataset, self.indices[idx], self.chunk_size)
+        try:
+            idx = int(idx)
+        except:
+            return Subset(self.dataset, self.indices[np.asarray(idx)], self.chunk_size)
+        if idx > len(self) - 1:
+            raise StopIteration
+        return self.dataset[self.indices[idx]]
+
+    @property
+    def sizes(self):
+        """ The item sizes of the subset, see :attr:`FrameworkDataset.sizes`.
+        """
+        return {k: v[self.indices] for k, v in self.dataset.sizes.items()}
+
+    def __getitems__(self, indices):
+        if isinstance(self.dataset, FrameworkDataset):
+            return self.dataset[self.indices[np.asarray(indices, dtype=np.int64)]]
+        return [self[i] for i in indices]
+
+    def __iter__(self):
+        if isinstance(self.dataset, FrameworkDataset) and self.indices.ndim == 1:
+            # read in chunks to profit from batched reads
+            for start in range(0, len(self.indices), self.chunk_size):
+                yield from self.dataset[self.indices[start:start+self.chunk_size]]
+        else:
+            for idx in self.indices:
+                yield self.dataset[idx]
+
+    def prefetch(self, depth=8, n_workers=2, backend='thread', ordered=True, chunk_size=1, indices=None):
+        """ Returns an iterator which loads the items of the subset in the background, see :meth:`FrameworkDataset.prefetch`.
+        """
+        return Prefetcher(self, indices=indices, depth=depth, n_workers=n_workers, backend=backend, ordered=ordered, chunk_size=chunk_size)
+
+    def __getattr__(self, name):
+        if name in ['dataset', 'indices', 'chunk_size']: # not yet set, e.g. during unpickling
+            raise AttributeError(name)
+        return getattr(self.dataset, name)
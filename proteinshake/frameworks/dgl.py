@@ -1,16 +1,186 @@
+import os
 import dgl
 import torch
+import numpy as np
 from dgl.data import DGLDataset
 from proteinshake.frameworks.dataset import FrameworkDataset
+from proteinshake.frameworks.storage import Storage, PackedStorage
+from proteinshake.utils import save, load, stable_hash
+from proteinshake.utils.neighbors import NeighborIndex, neighbor_mask, batched_graphs
+from proteinshake.utils.encodings import rbf_encoding
+
+
+class DGLBatchedStorage(Storage):
+    """ Stores the graphs in large binary chunks with DGL's native graph serialization (including node and edge data), plus an index of the chunk and position of every graph.
+    Any subset of graphs is loaded with one :func:`dgl.load_graphs` call per chunk. The protein dictionaries are kept in a :class:`proteinshake.frameworks.storage.PackedStorage`.
+
+    Parameters
+    ----------
+    path: str
+        Directory of the store.
+    compression: str, default None
+        Compression of the protein dictionaries, see :class:`proteinshake.frameworks.storage.PackedStorage`.
+    use_mmap: bool, default False
+        Whether the protein dictionaries are read from memory-mapped files.
+    chunk_size: int, default 4096
+        The number of graphs per chunk file.
+    """
+
+    def __init__(self, path, compression=None, use_mmap=False, chunk_size=4096):
+        super().__init__(path)
+        self.chunk_size = chunk_size
+        self.records = PackedStorage(path, compression=compression, use_mmap=use_mmap, name='batched.proteins')
+        self._index = None
+
+    def exists(self):
+        return os.path.exists(f'{self.path}/batched.index.npy')
+
+    def write(self, items):
+        index, buffer = [], []
+        def flush():
+            dgl.save_graphs(f'{self.path}/batched.{index[-1][0]}.bin', buffer)
+            buffer.clear()
+        def records():
+            for data, protein_dict in items:
+                index.append((len(index) // self.chunk_size, len(buffer)))
+                buffer.append(data)
+                if len(buffer) == self.chunk_size:
+                    flush()
+                yield protein_dict
+        size = self.records.write(records())
+        if len(buffer) > 0:
+            flush()
+        save(np.array(index, dtype=np.int64).reshape(-1, 2), f'{self.path}/batched.index.npy')
+        return size
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = load(f'{self.path}/batched.index.npy')
+        return self._index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, idx):
+        return self.read_many([idx])[0]
+
+    def read_many(self, indices, n_threads=1):
+        protein_dicts = self.records.read_many(indices, n_threads=n_threads)
+        entries = self.index[np.asarray(indices, dtype=np.int64).reshape(-1)]
+        graphs = [None] * len(entries)
+        for chunk in np.unique(entries[:,0]):
+            positions = np.where(entries[:,0] == chunk)[0]
+            loaded, _ = dgl.load_graphs(f'{self.path}/batched.{chunk}.bin', entries[positions,1].tolist())
+            for i, graph in zip(positions, loaded):
+                graphs[i] = graph
+        return list(zip(graphs, protein_dicts))
 
 
 class DGLGraphDataset(FrameworkDataset, DGLDataset):
     """ Graph dataset for Deep Graph Library (DGL).
+
+    With ``storage='batched'``, graphs are stored in large chunks of DGL's binary graph format instead of one pickle per graph.
+
+    Graphs of a neighbor index are stored with all candidate edges and their `distance` and `rank` edge data, and the edges selected by `neighbors` are sliced out on load.
+    Graphs built on the fly are stored with node positions `pos` and without edges, which are added when the items are loaded (see :meth:`build_edges`), with one neighbor search per batch of a DataLoader.
+    Precomputed encodings are converted to float32 on load, and the edge lengths are expanded into `edge_rbf` with the (bins, cutoff) given by `edge_rbf`.
     """
 
+    storages = {**FrameworkDataset.storages, 'batched': DGLBatchedStorage}
+
+    def __init__(self, *args, neighbors=None, edge_rbf=None, **kwargs):
+        self.neighbors = neighbors
+        self.edge_rbf = edge_rbf
+        super().__init__(*args, **kwargs)
+
     def convert_to_framework(self, data_item):
         nodes, adj = data_item.data
+        if isinstance(adj, np.ndarray):
+            data = dgl.graph(([], []), num_nodes=len(adj))
+            data.ndata['pos'] = torch.from_numpy(adj)
+            data.ndata[f'{data_item.resolution}'] = torch.tensor(nodes).long()
+            return data
+        if isinstance(adj, NeighborIndex):
+            rows, cols, distances, ranks = adj.edges()
+            data = dgl.graph((torch.from_numpy(rows), torch.from_numpy(cols)), num_nodes=adj.n)
+            data.edata['distance'] = torch.from_numpy(distances)
+            data.edata['rank'] = torch.from_numpy(ranks.astype(np.int32))
+            data.ndata[f'{data_item.resolution}'] = torch.tensor(nodes).long()
+            return data
         data = dgl.from_scipy(adj, eweight_name='edge_weight')
         if data_item.weighted_edges:
             data.ndata[f'{data_item.resolution}'] = torch.tensor(nodes).long()
+        for key, value in data_item.encodings.items():
+            (data.edata if key.startswith('edge_') else data.ndata)[key] = torch.from_numpy(value)
         return data
+
+    def load_transform(self, data, protein_dict):
+        if self.neighbors is None or not 'rank' in data.edata:
+            node_encodings = {key: data.ndata[key].float() for key in ['laplacian_eigenvector_pe', 'random_walk_pe'] if key in data.ndata}
+            edge_encodings = {}
+            if not self.edge_rbf is None and 'edge_distance' in data.edata:
+                edge_encodings['edge_rbf'] = torch.from_numpy(rbf_encoding(data.edata['edge_distance'].numpy(), *self.edge_rbf)).float()
+            if len(node_encodings) + len(edge_encodings) > 0:
+                # the stored graph may be a cache entry, clone its feature frames before assigning
+                data = data.clone()
+                data.ndata.update(node_encodings)
+                data.edata.update(edge_encodings)
+            return data, protein_dict
+        mask = neighbor_mask(data.edata['distance'], data.edata['rank'], eps=self.neighbors['eps'], k=self.neighbors['k'])
+        data = dgl.edge_subgraph(data, mask, relabel_nodes=False, store_ids=False)
+        distance, _ = data.edata.pop('distance'), data.edata.pop('rank')
+        data.edata['edge_weight'] = distance if self.neighbors['weighted_edges'] else torch.ones(data.num_edges(), dtype=distance.dtype)
+        return data, protein_dict
+
+    def collate(self, batch):
+        """ Collates graphs into a batched DGL graph. Items loaded from the dataset already have their edges, see :meth:`build_edges`. Use as the ``collate_fn`` of a DataLoader.
+
+        Parameters
+        ----------
+        batch: list
+            A list of (data, protein_dict) items.
+
+        Returns
+        -------
+        tuple
+            The batched graph and the list of protein dictionaries.
+        """
+        graphs = [data for data, _ in self.build_edges(batch)]
+        return dgl.batch(graphs), [protein_dict for _, protein_dict in batch]
+
+    def build_edges(self, items):
+        """ Constructs the edges of graphs built on the fly, with one neighbor search for all items. Called when items are loaded, after `transform`, so that augmented coordinates are used. Items which already have edges are returned unchanged.
+        """
+        if self.neighbors is None:
+            return items
+        graphs = [data for data, _ in items]
+        pending = [i for i, data in enumerate(graphs) if data.num_edges() == 0 and 'pos' in data.ndata]
+        if len(pending) > 0:
+            coords = torch.cat([graphs[i].ndata['pos'] for i in pending]).numpy()
+            ptr = np.concatenate([[0], np.cumsum([graphs[i].num_nodes() for i in pending])])
+            edges = batched_graphs(coords, ptr, eps=self.neighbors['eps'], k=self.neighbors['k'], weighted=self.neighbors['weighted_edges'])
+            for i, (rows, cols, values) in zip(pending, edges):
+                graph = dgl.graph((torch.from_numpy(rows), torch.from_numpy(cols)), num_nodes=graphs[i].num_nodes())
+                graph.ndata.update(graphs[i].ndata)
+                graph.edata['edge_weight'] = torch.from_numpy(values)
+                graphs[i] = graph
+        return [(data, protein_dict) for data, (_, protein_dict) in zip(graphs, items)]
+
+    def __getitem__(self, idx):
+        items = super().__getitem__(idx)
+        if isinstance(items, tuple):
+            return self.build_edges([items])[0]
+        return self.build_edges(items)
+
+    @property
+    def sizes_file(self):
+        # the edges sliced out of a neighbor index depend on the selected eps or k
+        if self.neighbors is None:
+            return super().sizes_file
+        return f'{self.path}/sizes_{stable_hash(self.neighbors)}.pkl'
+
+    def item_size(self, data, protein_dict):
+        if not self.neighbors is None and 'rank' in data.edata: # count the edges of the requested graph, not of the whole neighbor index
+            data, protein_dict = self.load_transform(data, protein_dict)
+        return {**super().item_size(data, protein_dict), 'edges': data.num_edges()}
@@ -8,18 +8,67 @@ from scipy import sparse
 
 from proteinshake.utils import load, save
 from proteinshake.frameworks.dataset import FrameworkDataset
+from proteinshake.frameworks.storage import CollatedStorage
 
 class NumpyVoxelDataset(FrameworkDataset):
     """ Voxel dataset for NumPy.
+
+    With ``storage='collated'``, all voxel grids are stacked into one memory-mapped array of shape (N, X, Y, Z, C) and items are returned as views into it.
+    With ``storage='sparse'``, only the occupied voxels are stored and items are returned as a tuple of views (coords, features), where coords has shape (n, 3) and features has shape (n, C). Use :func:`densify` to obtain the grid.
     """
 
+    storages = {**FrameworkDataset.storages, 'collated': CollatedStorage, 'sparse': CollatedStorage}
+
     def convert_to_framework(self, data_item):
         return data_item.data
 
+    def to_arrays(self, data):
+        if self.storage.name == 'sparse':
+            coords = np.argwhere(np.any(data != 0, axis=-1))
+            return {'coords': coords.astype(np.int32), 'features': data[tuple(coords.T)]}, None
+        return {'voxels': data[None]}, None
+
+    def from_arrays(self, arrays, extras):
+        if 'voxels' in arrays:
+            return arrays['voxels'][0]
+        return arrays['coords'], arrays['features']
+
 
 class NumpyPointDataset(FrameworkDataset):
     """ Point dataset for NumPy.
+
+    With ``storage='collated'``, all point clouds are concatenated into one memory-mapped array with an offset array, and items are returned as views into it.
     """
 
+    storages = {**FrameworkDataset.storages, 'collated': CollatedStorage}
+
     def convert_to_framework(self, data_item):
         return data_item.data
+
+    def to_arrays(self, data):
+        return {'points': data}, None
+
+    def from_arrays(self, arrays, extras):
+        return arrays['points']
+
+
+def densify(coords, features, gridsize):
+    """ Converts sparse voxels, as returned by a :class:`NumpyVoxelDataset` with ``storage='sparse'``, to a dense grid.
+
+    Parameters
+    ----------
+    coords: ndarray
+        The (n, 3) voxel indices of the occupied voxels.
+    features: ndarray
+        The (n, C) features of the occupied voxels.
+    gridsize: tuple
+        The (X, Y, Z) size of the grid.
+
+    Returns
+    -------
+    ndarray
+        The voxel grid of shape (X, Y, Z, C).
+    """
+    voxels = np.zeros((*gridsize, features.shape[-1]), dtype=features.dtype)
+    voxels[tuple(np.asarray(coords).T)] = features
+    return voxels
@@ -1,13 +1,57 @@
+import numpy as np
 import networkx as nx
+from scipy.sparse import csr_matrix
 from proteinshake.frameworks.dataset import FrameworkDataset
+from proteinshake.utils import stable_hash
+from proteinshake.utils.neighbors import NeighborIndex, neighbor_mask
 
 
 class NetworkxGraphDataset(FrameworkDataset):
     """ Graph dataset for NetworkX.
+
+    Graphs of a neighbor index are stored as directed graphs of all candidate edges with their `distance` and `rank`, and the edges selected by `neighbors` are sliced out on load.
     """
 
-    def convert_to_framework(self, data_item):
-        nodes, adj = data_item.data
+    def __init__(self, *args, neighbors=None, **kwargs):
+        self.neighbors = neighbors
+        super().__init__(*args, **kwargs)
+
+    def _from_adjacency(self, nodes, adj):
         data = nx.from_scipy_sparse_array(adj)
         data.add_nodes_from(nodes)
         return data
+
+    def convert_to_framework(self, data_item):
+        nodes, adj = data_item.data
+        if isinstance(adj, NeighborIndex):
+            rows, cols, distances, ranks = adj.edges()
+            data = nx.DiGraph(nodes=nodes)
+            data.add_nodes_from(range(adj.n))
+            data.add_edges_from((u, v, {'distance': d, 'rank': r}) for u, v, d, r in zip(rows.tolist(), cols.tolist(), distances.tolist(), ranks.tolist()))
+            return data
+        return self._from_adjacency(nodes, adj)
+
+    def load_transform(self, data, protein_dict):
+        if self.neighbors is None or not 'nodes' in data.graph:
+            return data, protein_dict
+        n, edges = data.number_of_nodes(), list(data.edges(data=True))
+        rows = np.array([u for u, _, _ in edges], dtype=np.int64)
+        cols = np.array([v for _, v, _ in edges], dtype=np.int64)
+        distances = np.array([d['distance'] for _, _, d in edges], dtype=np.float64)
+        ranks = np.array([d['rank'] for _, _, d in edges], dtype=np.int64)
+        mask = neighbor_mask(distances, ranks, eps=self.neighbors['eps'], k=self.neighbors['k'])
+        values = distances[mask] if self.neighbors['weighted_edges'] else np.ones(mask.sum())
+        adj = csr_matrix((values, (rows[mask], cols[mask])), shape=(n, n))
+        return self._from_adjacency(data.graph['nodes'], adj), protein_dict
+
+    @property
+    def sizes_file(self):
+        # the edges sliced out of a neighbor index depend on the selected eps or k
+        if self.neighbors is None:
+            return super().sizes_file
+        return f'{self.path}/sizes_{stable_hash(self.neighbors)}.pkl'
+
+    def item_size(self, data, protein_dict):
+        if not self.neighbors is None and 'nodes' in data.graph: # count the edges of the requested graph, not of the whole neighbor index
+            data, protein_dict = self.load_transform(data, protein_dict)
+        return {**super().item_size(data, protein_dict), 'edges': data.number_of_edges()}
@@ -0,0 +1,92 @@
+import collections
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+_worker_dataset = None
+
+def _init_worker(dataset):
+    global _worker_dataset
+    _worker_dataset = dataset
+
+def _fetch(dataset, chunk):
+    if hasattr(dataset, '__getitems__'):
+        return dataset.__getitems__(chunk)
+    return [dataset[i] for i in chunk]
+
+def _fetch_in_worker(chunk):
+    return _fetch(_worker_dataset, chunk)
+
+
+class Prefetcher():
+    """ Iterates over a dataset while background workers load and decode the next items, to hide I/O latency in training loops without a DataLoader.
+
+    .. code-block:: python
+
+        >>> dataset = RCSBDataset().to_graph(eps=8).nx()
+        >>> for graph, protein_dict in dataset.prefetch(depth=16):
+        ...     train_step(graph)
+
+    Parameters
+    ----------
+    dataset: FrameworkDataset
+        The dataset (or a :class:`proteinshake.frameworks.dataset.Subset`).
+    indices: array_like, default None
+        The indices to iterate over, in this order. Defaults to all items.
+    depth: int, default 8
+        The maximum number of chunks which are loaded ahead.
+    n_workers: int, default 2
+        The number of background workers.
+    backend: str, default 'thread'
+        'thread' or 'process'. Processes avoid the global interpreter lock for expensive decoding and transforms, but the items are pickled to be sent back. Each process receives a copy of the dataset once.
+    ordered: bool, default True
+        If `True`, items are returned in the order of `indices`. If `False`, items are returned as soon as they are loaded.
+    chunk_size: int, default 1
+        The number of items loaded together by one worker, using batched reads.
+    """
+
+    def __init__(self, dataset, indices=None, depth=8, n_workers=2, backend='thread', ordered=True, chunk_size=1):
+        if not backend in ['thread', 'process']:
+            raise ValueError(f'Unknown backend {backend}. Use "thread" or "process".')
+        self.dataset = dataset
+        self.indices = np.arange(len(dataset)) if indices is None else np.asarray(indices)
+        self.depth = depth
+        self.n_workers = n_workers
+        self.backend = backend
+        self.ordered = ordered
+        self.chunk_size = chunk_size
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __iter__(self):
+        chunks = (self.indices[i:i+self.chunk_size] for i in range(0, len(self.indices), self.chunk_size))
+        if self.backend == 'thread':
+            executor = ThreadPoolExecutor(self.n_workers)
+            submit = lambda chunk: executor.submit(_fetch, self.dataset, chunk)
+        else:
+            executor = ProcessPoolExecutor(self.n_workers, initializer=_init_worker, initargs=(self.dataset,))
+            submit = lambda chunk: executor.submit(_fetch_in_worker, chunk)
+        pending = collections.deque()
+        try:
+            for chunk in chunks:
+                pending.append(submit(chunk))
+                if len(pending) >= self.depth:
+                    yield from self._next(pending)
+            while len(pending) > 0:
+                yield from self._next(pending)
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def _next(self, pending):
+        """ Takes the next finished chunk from the queue of pending chunks.
+        """
+        if self.ordered:
+            future = pending.popleft()
+        else:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            future = next(iter(done))
+            pending.remove(future)
+        return future.result()
@@ -1,17 +1,132 @@
+import copy
 import torch
+import numpy as np
 from torch_geometric.utils import from_scipy_sparse_matrix
-from torch_geometric.data import Data, Dataset as PygDataset
+from torch_geometric.data import Data, Batch, Dataset as PygDataset
 from proteinshake.frameworks.dataset import FrameworkDataset
+from proteinshake.utils import stable_hash
+from proteinshake.frameworks.storage import CollatedStorage
+from proteinshake.utils.neighbors import NeighborIndex, neighbor_mask, batched_graphs
+from proteinshake.utils.encodings import rbf_encoding
 
 
 class PygGraphDataset(FrameworkDataset, PygDataset):
     """ Graph dataset for PyG.
+
+    With ``storage='collated'``, the node features, edge indices and edge attributes of all graphs are stored as a few large concatenated arrays with slice pointers, which are memory-mapped on load. Accessing a graph then only slices these arrays.
+
+    Graphs of a neighbor index are stored with all candidate edges and their `edge_distance` and `edge_rank`, and the edges selected by `neighbors` are sliced out on load.
+    Graphs built on the fly are stored with node positions `pos` and without edges, which are added when the items are loaded (see :meth:`build_edges`), with one neighbor search per batch of a DataLoader.
+    Precomputed encodings are converted to float32 on load, and the edge lengths are expanded into `edge_rbf` with the (bins, cutoff) given by `edge_rbf`.
     """
 
+    storages = {**FrameworkDataset.storages, 'collated': CollatedStorage}
+
+    def __init__(self, *args, neighbors=None, edge_rbf=None, **kwargs):
+        self.neighbors = neighbors
+        self.edge_rbf = edge_rbf
+        super().__init__(*args, **kwargs)
+
     def convert_to_framework(self, data_item):
         nodes, adj = data_item.data
+        if isinstance(adj, np.ndarray):
+            return Data(x=torch.from_numpy(nodes), pos=torch.from_numpy(adj))
+        if isinstance(adj, NeighborIndex):
+            rows, cols, distances, ranks = adj.edges()
+            return Data(
+                x = torch.from_numpy(nodes),
+                edge_index = torch.from_numpy(np.stack([rows, cols])).long(),
+                edge_distance = torch.from_numpy(distances),
+                edge_rank = torch.from_numpy(ranks.astype(np.int32))
+            )
+        edge_index, edge_attr = from_scipy_sparse_matrix(adj)
         return Data(
             x = torch.from_numpy(nodes),
-            edge_index = from_scipy_sparse_matrix(adj)[0].long(),
-            edge_attr = from_scipy_sparse_matrix(adj)[1].unsqueeze(1).float()
+            edge_index = edge_index.long(),
+            edge_attr = edge_attr.unsqueeze(1).float(),
+            **{key: torch.from_numpy(value) for key, value in data_item.encodings.items()}
         )
+
+    def load_transform(self, data, protein_dict):
+        if self.neighbors is None or not 'edge_rank' in data:
+            return self.load_encodings(data), protein_dict
+        mask = neighbor_mask(data.edge_distance, data.edge_rank, eps=self.neighbors['eps'], k=self.neighbors['k'])
+        edge_attr = data.edge_distance[mask] if self.neighbors['weighted_edges'] else torch.ones(int(mask.sum()))
+        return Data(x=data.x, edge_index=data.edge_index[:,mask], edge_attr=edge_attr.unsqueeze(1).float()), protein_dict
+
+    def load_encodings(self, data):
+        encodings = {key: data[key].float() for key in ['laplacian_eigenvector_pe', 'random_walk_pe'] if key in data}
+        if not self.edge_rbf is None and 'edge_distance' in data:
+            encodings['edge_rbf'] = torch.from_numpy(rbf_encoding(data.edge_distance.numpy(), *self.edge_rbf)).float()
+        if len(encodings) == 0:
+            return data
+        data = copy.copy(data)
+        for key, value in encodings.items():
+            data[key] = value
+        return data
+
+    def collate(self, batch):
+        """ Collates graphs into a PyG batch. Items loaded from the dataset already have their edges, see :meth:`build_edges`. Use as the ``collate_fn`` of a DataLoader.
+
+        Parameters
+        ----------
+        batch: list
+            A list of (data, protein_dict) items.
+
+        Returns
+        -------
+        tuple
+            The :class:`torch_geometric.data.Batch` and the list of protein dictionaries.
+        """
+        graphs = [data for data, _ in self.build_edges(batch)]
+        return Batch.from_data_list(graphs), [protein_dict for _, protein_dict in batch]
+
+    def build_edges(self, items):
+        """ Constructs the edges of graphs built on the fly, with one neighbor search for all items. Called when items are loaded, after `transform`, so that augmented coordinates are used. Items which already have edges are returned unchanged.
+        """
+        if self.neighbors is None:
+            return items
+        graphs = [data for data, _ in items]
+        pending = [i for i, data in enumerate(graphs) if data.edge_index is None]
+        if len(pending) > 0:
+            coords = torch.cat([graphs[i].pos for i in pending]).numpy()
+            ptr = np.concatenate([[0], np.cumsum([graphs[i].num_nodes for i in pending])])
+            edges = batched_graphs(coords, ptr, eps=self.neighbors['eps'], k=self.neighbors['k'], weighted=self.neighbors['weighted_edges'])
+            for i, (rows, cols, values) in zip(pending, edges):
+                graphs[i] = copy.copy(graphs[i])
+                graphs[i].edge_index = torch.from_numpy(np.stack([rows, cols])).long()
+                graphs[i].edge_attr = torch.from_numpy(values).unsqueeze(1).float()
+        return [(data, protein_dict) for data, (_, protein_dict) in zip(graphs, items)]
+
+    def __getitem__(self, idx):
+        items = super().__getitem__(idx)
+        if isinstance(items, tuple):
+            return self.build_edges([items])[0]
+        return self.build_edges(items)
+
+    def to_arrays(self, data):
+        arrays, extras = {}, {'cat_dims': {}}
+        for key, value in data.to_dict().items():
+            if torch.is_tensor(value):
+                cat_dim = data.__cat_dim__(key, value)
+                arrays[key] = torch.movedim(value, cat_dim, 0).numpy()
+                extras['cat_dims'][key] = cat_dim
+            else:
+                extras[key] = value
+        return arrays, extras
+
+    def from_arrays(self, arrays, extras):
+        tensors = {key: torch.movedim(torch.from_numpy(value), 0, extras['cat_dims'][key]) for key, value in arrays.items()}
+        return Data(**tensors, **{k:v for k,v in extras.items() if k != 'cat_dims'})
+
+    @property
+    def sizes_file(self):
+        # the edges sliced out of a neighbor index depend on the selected eps or k
+        if self.neighbors is None:
+            return super().sizes_file
+        return f'{self.path}/sizes_{stable_hash(self.neighbors)}.pkl'
+
+    def item_size(self, data, protein_dict):
+        if not self.neighbors is None and 'edge_rank' in data: # count the edges of the requested graph, not of the whole neighbor index
+            data, protein_dict = self.load_transform(data, protein_dict)
+        return {**super().item_size(data, protein_dict), 'edges': data.num_edges}
@@ -0,0 +1,103 @@
+import numpy as np
+
+from proteinshake.utils import warning
+
+
+class DynamicBatchSampler():
+    """ Batch sampler which groups items of similar size and caps the total size of each batch, instead of using a fixed number of items per batch.
+    Items are shuffled, split into buckets, sorted by size within each bucket and greedily packed into batches. The order of the batches is shuffled again.
+    Use it as the ``batch_sampler`` of a PyTorch or PyG ``DataLoader``.
+
+    .. code-block:: python
+
+        >>> from torch_geometric.loader import DataLoader
+        >>> from proteinshake.frameworks.sampler import DynamicBatchSampler
+        >>> dataset = RCSBDataset().to_graph(eps=8).pyg()
+        >>> loader = DataLoader(dataset, batch_sampler=DynamicBatchSampler(dataset, max_size=10000))
+
+    Parameters
+    ----------
+    dataset: FrameworkDataset
+        The dataset (or a :class:`proteinshake.frameworks.dataset.Subset`) to sample from. Can also be an array of item sizes.
+    max_size: int
+        The maximum total size of a batch. Items larger than `max_size` form a batch on their own.
+    key: str, default 'nodes'
+        Which size to use, see :meth:`proteinshake.frameworks.dataset.FrameworkDataset.item_size`. Can be 'nodes' or, for graphs, 'edges'.
+    padded: bool, default False
+        If `True`, the size of a batch is the size of its largest item times the number of items (e.g. for padded sequence models). Otherwise it is the sum of the item sizes.
+    bucket_size: int, default 1024
+        The number of items which are sorted together. Smaller buckets are more random, larger buckets group sizes more tightly.
+    max_batch_size: int, default None
+        Optional maximum number of items per batch.
+    shuffle: bool, default True
+        Whether to shuffle the items and batches.
+    drop_last: bool, default False
+        Whether to drop the last, possibly smaller batch of each bucket.
+    seed: int, default 0
+        Random seed. The batches of an epoch are determined by the seed and the epoch, see :meth:`set_epoch`.
+    """
+
+    def __init__(self, dataset, max_size, key='nodes', padded=False, bucket_size=1024, max_batch_size=None, shuffle=True, drop_last=False, seed=0):
+        sizes = dataset.sizes[key] if hasattr(dataset, 'sizes') else dataset
+        self.sizes = np.asarray(sizes, dtype=np.int64)
+        self.max_size = max_size
+        self.padded = padded
+        self.bucket_size = bucket_size
+        self.max_batch_size = max_batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+        self._batches = None
+        if (self.sizes > max_size).any():
+            warning(f'{(self.sizes > max_size).sum()} items are larger than max_size={max_size} and will be put into batches of their own.')
+
+    def set_epoch(self, epoch):
+        """ Sets the epoch, which determines the random batches. Without calling it, the epoch is increased after every full iteration.
+        """
+        self.epoch = epoch
+        self._batches = None
+
+    @property
+    def batches(self):
+        if self._batches is None:
+            self._batches = self.compute_batches()
+        return self._batches
+
+    def compute_batches(self):
+        """ Computes the batches of the current epoch.
+
+        Returns
+        -------
+        list
+            A list of index lists.
+        """
+        rng = np.random.default_rng([self.seed, self.epoch])
+        order = rng.permutation(len(self.sizes)) if self.shuffle else np.arange(len(self.sizes))
+        batches = []
+        for start in range(0, len(order), self.bucket_size):
+            bucket = order[start:start+self.bucket_size]
+            bucket = bucket[np.argsort(self.sizes[bucket], kind='stable')]
+            batch, total, largest = [], 0, 0
+            for idx in bucket:
+                size = self.sizes[idx]
+                new_total = max(largest, size) * (len(batch) + 1) if self.padded else total + size
+                full = self.max_batch_size is not None and len(batch) >= self.max_batch_size
+                if len(batch) > 0 and (new_total > self.max_size or full):
+                    batches.append(batch)
+                    batch, total, largest = [], 0, 0
+                    new_total = size
+                batch.append(int(idx))
+                total, largest = new_total, max(largest, size)
+            if len(batch) > 0 and not self.drop_last:
+                batches.append(batch)
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        return batches
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __iter__(self):
+        yield from self.batches
+        self.set_epoch(self.epoch + 1)
@@ -0,0 +1,491 @@
+"""
+On-disk item stores for framework datasets.
+
+A store writes the converted items of a dataset once and then provides random access to them by index.
+"""
+
+import os
+import sys
+import bz2
+import lzma
+import mmap
+import zlib
+import pickle
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from proteinshake.utils import save, load
+
+COMPRESSION = {
+    'zlib': (zlib.compress, zlib.decompress),
+    'bz2': (bz2.compress, bz2.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+}
+
+def _pread(fd, length, offset):
+    """ Reads `length` bytes at `offset` from a file descriptor, without moving the file position if possible.
+    """
+    if hasattr(os, 'pread'):
+        return os.pread(fd, length, offset)
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.read(fd, length)
+
+
+class Storage():
+    """ Base class for item stores.
+
+    Parameters
+    ----------
+    path: str
+        Directory of the store.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def exists(self):
+        """ Whether the store has been completely written.
+        """
+        raise NotImplementedError
+
+    def write(self, items):
+        """ Writes all items to disk.
+
+        Parameters
+        ----------
+        items: iterable
+            The items to be stored.
+
+        Returns
+        -------
+        int
+            The number of stored items.
+        """
+        raise NotImplementedError
+
+    def read_many(self, indices, n_threads=1):
+        """ Reads several items at once.
+
+        Parameters
+        ----------
+        indices: array_like
+            The indices of the items.
+        n_threads: int, default 1
+            The number of threads used to read and decode the items.
+
+        Returns
+        -------
+        list
+            The items, in the order of `indices`.
+        """
+        if n_threads > 1 and len(indices) > 1:
+            with ThreadPoolExecutor(n_threads) as executor:
+                return list(executor.map(self.__getitem__, indices))
+        return [self[idx] for idx in indices]
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def __getitem__(self, idx):
+        raise NotImplementedError
+
+
+class PickleStorage(Storage):
+    """ Stores every item in a separate pickle file.
+    """
+
+    def exists(self):
+        if not os.path.exists(f'{self.path}/size.pkl'):
+            return False
+        size = load(f'{self.path}/size.pkl')
+        return size == 0 or os.path.exists(f'{self.path}/{size-1}.pkl')
+
+    def write(self, items):
+        i = 0
+        for item in items:
+            save(item, f'{self.path}/{i}.pkl')
+            i += 1
+        save(i, f'{self.path}/size.pkl')
+        return i
+
+    def __len__(self):
+        return load(f'{self.path}/size.pkl')
+
+    def __getitem__(self, idx):
+        return load(f'{self.path}/{idx}.pkl')
+
+
+class PackedStorage(Storage):
+    """ Stores all items serialized back to back in a few large shard files, plus an offset index.
+    Reading an item is a single positioned read (or a slice of a memory map) at the offset given by the index.
+
+    Parameters
+    ----------
+    path: str
+        Directory of the store.
+    compression: str, default None
+        Per-item compression. Can be None, 'zlib', 'bz2' or 'lzma'.
+    use_mmap: bool, default False
+        If `True`, reads from memory-mapped shards instead of positioned reads.
+    shard_size: int, default 2**31
+        Approximate maximum size of a shard file in bytes.
+    name: str, default 'packed'
+        Prefix of the file names of the store.
+    """
+
+    def __init__(self, path, compression=None, use_mmap=False, shard_size=2**31, name='packed'):
+        super().__init__(path)
+        self.name = name
+        self.compression = compression
+        self.use_mmap = use_mmap
+        self.shard_size = shard_size
+        self._index = None
+        self._handles = None
+
+    def exists(self):
+        return os.path.exists(f'{self.path}/{self.name}.index.npy')
+
+    def write(self, items):
+        compress = COMPRESSION[self.compression][0] if self.compression else None
+        index, shard, offset = [], 0, 0
+        file = open(f'{self.path}/{self.name}.{shard}.bin', 'wb')
+        try:
+            for item in items:
+                buffer = pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL)
+                if compress is not None:
+                    buffer = compress(buffer)
+                if offset > 0 and offset + len(buffer) > self.shard_size:
+                    file.close()
+                    shard, offset = shard + 1, 0
+                    file = open(f'{self.path}/{self.name}.{shard}.bin', 'wb')
+                file.write(buffer)
+                index.append((shard, offset, len(buffer)))
+                offset += len(buffer)
+        finally:
+            file.close()
+        save({'compression': self.compression, 'shards': shard + 1}, f'{self.path}/{self.name}.json')
+        # the index is written last and marks the store as complete
+        with open(f'{self.path}/{self.name}.index.tmp.npy', 'wb') as file:
+            np.save(file, np.array(index, dtype=np.int64).reshape(-1, 3))
+        os.replace(f'{self.path}/{self.name}.index.tmp.npy', f'{self.path}/{self.name}.index.npy')
+        return len(index)
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = load(f'{self.path}/{self.name}.index.npy')
+            self.compression = load(f'{self.path}/{self.name}.json')['compression']
+        return self._index
+
+    @property
+    def handles(self):
+        """ File descriptors (or memory maps) of the shards, opened lazily in each process.
+        """
+        if self._handles is None or self._handles[0] != os.getpid():
+            n_shards = load(f'{self.path}/{self.name}.json')['shards']
+            handles = []
+            for shard in range(n_shards):
+                fd = os.open(f'{self.path}/{self.name}.{shard}.bin', os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+                if self.use_mmap:
+                    handle = mmap.mmap(fd, 0, access=mmap.ACCESS_READ) if os.fstat(fd).st_size > 0 else b''
+                    os.close(fd)
+                    handles.append(handle)
+                else:
+                    handles.append(fd)
+            self._handles = (os.getpid(), handles)
+        return self._handles[1]
+
+    def read_bytes(self, shard, offset, length):
+        """ Reads a raw byte range of a shard.
+        """
+        handle = self.handles[shard]
+        if self.use_mmap:
+            return handle[offset:offset+length]
+        return _pread(handle, length, offset)
+
+    def decode(self, buffer):
+        """ Decompresses and unpickles a stored item.
+        """
+        if self.compression:
+            buffer = COMPRESSION[self.compression][1](buffer)
+        return pickle.loads(buffer)
+
+    def read_many(self, indices, n_threads=1, max_run=2**26):
+        """ Reads several items at once. The byte ranges of the requested items are sorted by their position on disk and adjacent ranges are merged into a single read of up to `max_run` bytes. The items are then decoded in a thread pool.
+        """
+        indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+        unique, inverse = np.unique(indices, return_inverse=True)
+        entries = self.index[unique]
+        order = np.lexsort((entries[:,1], entries[:,0])) # by shard, then offset
+        buffers = [None] * len(unique)
+        run = []
+        def flush():
+            shard, start = entries[run[0], 0], entries[run[0], 1]
+            end = entries[run[-1], 1] + entries[run[-1], 2]
+            block = memoryview(self.read_bytes(shard, start, end - start))
+            for i in run:
+                buffers[i] = block[entries[i,1]-start:entries[i,1]-start+entries[i,2]]
+        for i in order:
+            if run and not (entries[i,0] == entries[run[-1],0]
+                    and entries[i,1] == entries[run[-1],1] + entries[run[-1],2]
+                    and entries[i,1] + entries[i,2] - entries[run[0],1] <= max_run):
+                flush()
+                run = []
+            run.append(i)
+        if run:
+            flush()
+        buffers = [buffers[i] for i in inverse.reshape(-1)] # duplicates are decoded into separate objects
+        if n_threads > 1 and len(buffers) > 1:
+            with ThreadPoolExecutor(n_threads) as executor:
+                return list(executor.map(self.decode, buffers))
+        return [self.decode(buffer) for buffer in buffers]
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, idx):
+        shard, offset, length = self.index[idx]
+        return self.decode(self.read_bytes(shard, offset, length))
+
+    def __getstate__(self):
+        # open file handles and memory maps are not transferable to other processes
+        state = self.__dict__.copy()
+        state['_handles'] = None
+        return state
+
+    def __del__(self):
+        handles = getattr(self, '_handles', None)
+        if handles is not None and handles[0] == os.getpid():
+            for handle in handles[1]:
+                try:
+                    handle.close() if self.use_mmap else os.close(handle)
+                except Exception:
+                    pass
+
+
+class CollatedStorage(Storage):
+    """ Stores the arrays of all items concatenated into one memory-mapped ``.npy`` file per field, with a pointer array marking the slice of each item (like PyG's ``InMemoryDataset``).
+    Loading an item slices the memory maps without copying. Everything that is not an array (e.g. the protein dictionary) is kept in a :class:`PackedStorage`.
+
+    Parameters
+    ----------
+    path: str
+        Directory of the store.
+    to_arrays: function
+        Splits a data object into arrays. Signature: to_arrays(data) -> (arrays, extras), where arrays is a dict of NumPy arrays which are concatenated along their first axis and extras is any picklable object.
+    from_arrays: function
+        Inverse of `to_arrays`. Signature: from_arrays(arrays, extras) -> data
+    compression: str, default None
+        Compression of the non-array part, see :class:`PackedStorage`.
+    use_mmap: bool, default False
+        Whether the non-array part is read from memory-mapped files, see :class:`PackedStorage`.
+    name: str, default 'collated'
+        Prefix of the file names of the store.
+    """
+
+    def __init__(self, path, to_arrays, from_arrays, compression=None, use_mmap=False, name='collated'):
+        super().__init__(path)
+        self.name = name
+        self.to_arrays = to_arrays
+        self.from_arrays = from_arrays
+        self.records = PackedStorage(path, compression=compression, use_mmap=use_mmap, name=f'{name}.records')
+        self._arrays = None
+
+    def exists(self):
+        return os.path.exists(f'{self.path}/{self.name}.fields.json')
+
+    def write(self, items):
+        writers = {}
+        def records():
+            for data, protein_dict in items:
+                arrays, extras = self.to_arrays(data)
+                if len(writers) == 0:
+                    writers.update({field: _ArrayWriter(f'{self.path}/{self.name}.{field}') for field in arrays})
+                if not set(arrays) == set(writers):
+                    raise ValueError(f'All items need the same array fields. Expected {list(writers)}, got {list(arrays)}.')
+                for field, array in arrays.items():
+                    writers[field].append(array)
+                yield extras, protein_dict
+        try:
+            size = self.records.write(records())
+        finally:
+            for writer in writers.values():
+                writer.close()
+        save(list(writers), f'{self.path}/{self.name}.fields.json')
+        return size
+
+    @property
+    def arrays(self):
+        """ The memory-mapped (copy-on-write) arrays and pointers of all fields, opened lazily in each process.
+        """
+        if self._arrays is None:
+            fields = load(f'{self.path}/{self.name}.fields.json')
+            self._arrays = {field: (
+                np.load(f'{self.path}/{self.name}.{field}.npy', mmap_mode='c'),
+                np.load(f'{self.path}/{self.name}.{field}.ptr.npy'),
+                ) for field in fields}
+        return self._arrays
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, idx):
+        extras, protein_dict = self.records[idx]
+        arrays = {field: array[ptr[idx]:ptr[idx+1]] for field, (array, ptr) in self.arrays.items()}
+        return self.from_arrays(arrays, extras), protein_dict
+
+    def read_many(self, indices, n_threads=1):
+        records = self.records.read_many(indices, n_threads=n_threads)
+        return [
+            (self.from_arrays({field: array[ptr[idx]:ptr[idx+1]] for field, (array, ptr) in self.arrays.items()}, extras), protein_dict)
+            for idx, (extras, protein_dict) in zip(indices, records)
+        ]
+
+    def __getstate__(self):
+        # memory maps are reopened in every process instead of being copied
+        state = self.__dict__.copy()
+        state['_arrays'] = None
+        return state
+
+
+class _ArrayWriter():
+    """ Appends arrays to a raw file and finally converts it to a ``.npy`` file, together with a pointer array of the item boundaries.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(f'{path}.tmp', 'wb')
+        self.dtype, self.shape = None, None
+        self.lengths = []
+
+    def append(self, array):
+        array = np.ascontiguousarray(array)
+        if self.dtype is None:
+            self.dtype, self.shape = array.dtype, array.shape[1:]
+        if not (array.dtype == self.dtype and array.shape[1:] == self.shape):
+            raise ValueError(f'Cannot concatenate arrays of dtype {array.dtype} and shape {array.shape} with arrays of dtype {self.dtype} and shape (n, {self.shape}).')
+        self.file.write(array.tobytes())
+        self.lengths.append(len(array))
+
+    def close(self, chunk_bytes=2**26):
+        self.file.close()
+        dtype = np.dtype('float32') if self.dtype is None else self.dtype
+        shape = (int(np.sum(self.lengths)),) + (() if self.shape is None else self.shape)
+        if shape[0] == 0 or np.prod(shape) == 0:
+            np.save(f'{self.path}.npy', np.zeros(shape, dtype=dtype))
+        else:
+            out = np.lib.format.open_memmap(f'{self.path}.npy', mode='w+', dtype=dtype, shape=shape)
+            raw = np.memmap(f'{self.path}.tmp', dtype=dtype, mode='r', shape=shape)
+            chunk_size = max(1, chunk_bytes // (raw[0].nbytes or 1))
+            for start in range(0, shape[0], chunk_size):
+                out[start:start+chunk_size] = raw[start:start+chunk_size]
+            out.flush()
+            del out, raw
+        os.remove(f'{self.path}.tmp')
+        np.save(f'{self.path}.ptr.npy', np.concatenate([[0], np.cumsum(self.lengths, dtype=np.int64)]))
+
+
+def nbytes(obj, seen=None):
+    """ Estimates the memory footprint of an item in bytes. Understands NumPy, PyTorch and TensorFlow tensors and recurses into containers and object attributes.
+
+    Parameters
+    ----------
+    obj:
+        Any object.
+
+    Returns
+    -------
+    int
+        The estimated size in bytes.
+    """
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if getattr(obj, 'is_sparse', False) is True: # sparse torch tensor
+        return nbytes(obj.indices(), seen) + nbytes(obj.values(), seen)
+    if isinstance(getattr(obj, 'nbytes', None), (int, np.integer)):
+        return int(obj.nbytes)
+    if hasattr(obj, 'dtype') and hasattr(getattr(obj, 'shape', None), 'num_elements'): # tensorflow tensor
+        return int(obj.dtype.size * (obj.shape.num_elements() or 0))
+    if isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+        return sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(nbytes(k, seen) + nbytes(v, seen) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set)):
+        return sys.getsizeof(obj) + sum(nbytes(x, seen) for x in obj)
+    if hasattr(obj, '__dict__'):
+        return sys.getsizeof(obj) + nbytes(vars(obj), seen)
+    return sys.getsizeof(obj)
+
+
+class LRUCache():
+    """ A thread-safe least-recently-used cache, bounded by the total size of its items in bytes.
+
+    Parameters
+    ----------
+    capacity: int
+        Maximum total size of the cached items in bytes.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.items = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """ Returns the cached item, or None if it is not in the cache.
+        """
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return self.items[key][0]
+            self.misses += 1
+            return None
+
+    def put(self, key, item):
+        """ Adds an item, evicting the least recently used items if the capacity is exceeded. Items larger than the capacity are not cached.
+        """
+        size = nbytes(item)
+        if size > self.capacity:
+            return
+        with self.lock:
+            if key in self.items:
+                self.size -= self.items.pop(key)[1]
+            self.items[key] = (item, size)
+            self.size += size
+            while self.size > self.capacity:
+                self.size -= self.items.popitem(last=False)[1][1]
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.size = 0
+
+    def info(self):
+        """ Cache statistics.
+
+        Returns
+        -------
+        dict
+            Number of hits and misses, the number of cached items, and the used and total capacity in bytes.
+        """
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'items': len(self.items), 'bytes': self.size, 'capacity': self.capacity}
+
+    def __getstate__(self):
+        # every process keeps its own cache
+        state = self.__dict__.copy()
+        state['items'], state['size'], state['hits'], state['misses'], state['lock'] = OrderedDict(), 0, 0, 0, None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
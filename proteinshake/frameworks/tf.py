@@ -1,7 +1,185 @@
+import os
+import numpy as np
 import tensorflow as tf
 from proteinshake.frameworks.dataset import FrameworkDataset
+from proteinshake.frameworks.storage import Storage, PackedStorage, _pread
+from proteinshake.utils import save, load, error
 
-class TensorflowVoxelDataset(FrameworkDataset):
+
+class TFRecordStorage(Storage):
+    """ Stores the tensors in TFRecord shards, which can be read natively by ``tf.data``. Every record is a ``tf.train.Example`` with the serialized tensor (or the indices, values and shape of a sparse tensor) and the item index.
+    The position of every record is kept in an index, so single items can still be read with one positioned read. The protein dictionaries are kept in a :class:`proteinshake.frameworks.storage.PackedStorage`.
+
+    Parameters
+    ----------
+    path: str
+        Directory of the store.
+    compression: str, default None
+        Compression of the protein dictionaries, see :class:`proteinshake.frameworks.storage.PackedStorage`.
+    use_mmap: bool, default False
+        Whether the protein dictionaries are read from memory-mapped files.
+    shard_size: int, default 2**28
+        Approximate maximum size of a shard file in bytes.
+    """
+
+    def __init__(self, path, compression=None, use_mmap=False, shard_size=2**28):
+        super().__init__(path)
+        self.shard_size = shard_size
+        self.records = PackedStorage(path, compression=compression, use_mmap=use_mmap, name='tfrecord.proteins')
+        self._index, self._meta, self._handles = None, None, None
+
+    def exists(self):
+        return os.path.exists(f'{self.path}/tfrecord.index.npy')
+
+    def write(self, items):
+        index, meta, state = [], {}, {'shard': 0, 'offset': 0, 'writer': None}
+        def records():
+            for data, protein_dict in items:
+                if len(meta) == 0:
+                    meta.update({'sparse': isinstance(data, tf.SparseTensor), 'dtype': data.dtype.name})
+                example = self.encode(data, len(index)).SerializeToString()
+                if state['writer'] is None or (state['offset'] > 0 and state['offset'] + len(example) > self.shard_size):
+                    if not state['writer'] is None:
+                        state['writer'].close()
+                        state['shard'], state['offset'] = state['shard'] + 1, 0
+                    state['writer'] = tf.io.TFRecordWriter(f'{self.path}/tfrecord.{state["shard"]}.tfrecord')
+                state['writer'].write(example)
+                # a record is framed by an 8 byte length and a 4 byte checksum before, and a 4 byte checksum after the payload
+                index.append((state['shard'], state['offset'] + 12, len(example)))
+                state['offset'] += len(example) + 16
+                yield protein_dict
+        try:
+            size = self.records.write(records())
+        finally:
+            if not state['writer'] is None:
+                state['writer'].close()
+        save({**meta, 'shards': state['shard'] + 1 if len(index) > 0 else 0}, f'{self.path}/tfrecord.json')
+        save(np.array(index, dtype=np.int64).reshape(-1, 3), f'{self.path}/tfrecord.index.npy')
+        return size
+
+    def encode(self, data, idx):
+        """ Serializes a (sparse) tensor into a ``tf.train.Example``.
+        """
+        def feature(tensor):
+            return tf.train.Feature(bytes_list=tf.train.BytesList(value=[tf.io.serialize_tensor(tensor).numpy()]))
+        features = {'index': tf.train.Feature(int64_list=tf.train.Int64List(value=[idx]))}
+        if isinstance(data, tf.SparseTensor):
+            features.update({'indices': feature(data.indices), 'values': feature(data.values), 'dense_shape': feature(data.dense_shape)})
+        else:
+            features['tensor'] = feature(data)
+        return tf.train.Example(features=tf.train.Features(feature=features))
+
+    def decode(self, example, dense=False):
+        """ Parses a serialized ``tf.train.Example``. Can be used inside a ``tf.data`` graph.
+
+        Returns
+        -------
+        tuple
+            The (sparse) tensor and the item index.
+        """
+        dtype = tf.dtypes.as_dtype(self.meta['dtype'])
+        if self.meta['sparse']:
+            spec = {k: tf.io.FixedLenFeature([], tf.string) for k in ['indices', 'values', 'dense_shape']}
+        else:
+            spec = {'tensor': tf.io.FixedLenFeature([], tf.string)}
+        spec['index'] = tf.io.FixedLenFeature([], tf.int64)
+        features = tf.io.parse_single_example(example, spec)
+        if self.meta['sparse']:
+            data = tf.SparseTensor(
+                indices = tf.io.parse_tensor(features['indices'], tf.int64),
+                values = tf.io.parse_tensor(features['values'], dtype),
+                dense_shape = tf.io.parse_tensor(features['dense_shape'], tf.int64),
+            )
+            if dense:
+                data = tf.sparse.to_dense(data)
+        else:
+            data = tf.io.parse_tensor(features['tensor'], dtype)
+        return data, features['index']
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            self._meta = load(f'{self.path}/tfrecord.json')
+        return self._meta
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = load(f'{self.path}/tfrecord.index.npy')
+        return self._index
+
+    @property
+    def files(self):
+        return [f'{self.path}/tfrecord.{shard}.tfrecord' for shard in range(self.meta['shards'])]
+
+    @property
+    def handles(self):
+        if self._handles is None or self._handles[0] != os.getpid():
+            self._handles = (os.getpid(), [os.open(file, os.O_RDONLY | getattr(os, 'O_BINARY', 0)) for file in self.files])
+        return self._handles[1]
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, idx):
+        shard, offset, length = self.index[idx]
+        data, _ = self.decode(_pread(self.handles[shard], int(length), int(offset)))
+        return data, self.records[idx]
+
+    def to_tf_data(self, dense=True, shuffle_shards=False, deterministic=True, cycle_length=None):
+        """ See :meth:`TensorflowDataset.to_tf_data`.
+        """
+        files = tf.data.Dataset.from_tensor_slices(self.files)
+        if shuffle_shards:
+            files = files.shuffle(len(self.files))
+        dataset = files.interleave(
+            tf.data.TFRecordDataset,
+            cycle_length = cycle_length,
+            num_parallel_calls = tf.data.AUTOTUNE,
+            deterministic = deterministic,
+        )
+        return dataset.map(lambda example: self.decode(example, dense=dense), num_parallel_calls=tf.data.AUTOTUNE, deterministic=deterministic)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_handles'] = None
+        return state
+
+
+class TensorflowDataset(FrameworkDataset):
+    """ Base class of the TensorFlow datasets.
+
+    With ``storage='tfrecord'``, the tensors are written to TFRecord shards and :meth:`to_tf_data` provides a native ``tf.data`` input pipeline.
+    """
+
+    storages = {**FrameworkDataset.storages, 'tfrecord': TFRecordStorage}
+
+    def to_tf_data(self, dense=True, shuffle_shards=False, deterministic=True, cycle_length=None):
+        """ Returns a ``tf.data.Dataset`` which reads the TFRecord shards in parallel and decodes the tensors inside the TensorFlow graph. Requires ``storage='tfrecord'``.
+        The elements are (data, index) tuples, where index is the item index in this dataset, e.g. to look up targets. Note that the `transform` function in Python is not applied here; use ``tf.data.Dataset.map`` instead. `pre_transform` and `pre_filter` were applied when the records were written, so filtered items are not in the records.
+
+        Parameters
+        ----------
+        dense: bool, default True
+            If `True`, sparse tensors (voxels) are converted to dense on the fly.
+        shuffle_shards: bool, default False
+            If `True`, the order of the shards is shuffled.
+        deterministic: bool, default True
+            If `False`, elements may be returned out of order for higher throughput.
+        cycle_length: int, default None
+            The number of shards read concurrently. Defaults to the number of CPU cores.
+
+        Returns
+        -------
+        tf.data.Dataset
+            The input pipeline.
+        """
+        if not isinstance(self.storage, TFRecordStorage):
+            error('to_tf_data() requires storage="tfrecord".', verbosity=self.verbosity)
+        return self.storage.to_tf_data(dense=dense, shuffle_shards=shuffle_shards, deterministic=deterministic, cycle_length=cycle_length)
+
+
+class TensorflowVoxelDataset(TensorflowDataset):
     """ Voxel dataset for TensorFlow.
     """
 
@@ -12,7 +190,7 @@ class TensorflowVoxelDataset(FrameworkDataset):
         return tf.sparse.to_dense(data), protein_dict
 
 
-class TensorflowPointDataset(FrameworkDataset):
+class TensorflowPointDataset(TensorflowDataset):
     """ Point dataset for TensorFlow.
     """
 
@@ -1,22 +1,91 @@
 import torch
 from torch.utils.data import Dataset as TorchDataset
 from proteinshake.frameworks.dataset import FrameworkDataset
+from proteinshake.frameworks.storage import CollatedStorage
 
 
 class TorchVoxelDataset(FrameworkDataset, TorchDataset):
     """ Voxel dataset for PyTorch.
+
+    Voxels are stored as sparse tensors. By default they are converted to dense (X, Y, Z, C) tensors on load.
+    With ``sparse=True``, items are returned as a tuple (coords, features) of the occupied voxels instead, and :meth:`collate` batches them into a sparse tensor. This avoids building dense grids which are mostly empty.
+
+    With ``storage='collated'``, the indices and values of the sparse voxel tensors are stored in memory-mapped arrays and loaded as tensors without copying, such that DataLoader workers share the memory.
+
+    .. code-block:: python
+
+        >>> from torch.utils.data import DataLoader
+        >>> dataset = RCSBDataset().to_voxel().torch(sparse=True)
+        >>> loader = DataLoader(dataset, batch_size=32, collate_fn=dataset.collate)
+
+    Parameters
+    ----------
+    sparse: bool, default False
+        If `True`, returns the coordinates (n, 3) and features (n, C) of the occupied voxels instead of the dense grid.
     """
 
+    storages = {**FrameworkDataset.storages, 'collated': CollatedStorage}
+
+    def __init__(self, *args, sparse=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sparse = sparse
+        self.gridsize = tuple(self.storage[0][0].shape[:3]) if self.size > 0 else None
+
     def convert_to_framework(self, data_item):
-        return torch.tensor(data_item.data).float().to_sparse()
+        return torch.tensor(data_item.data).float().to_sparse(sparse_dim=3)
 
     def load_transform(self, data, protein_dict):
-        return data.to_dense(), protein_dict
+        if not self.sparse:
+            return data.to_dense(), protein_dict
+        if data.sparse_dim() != 3: # datasets created by older versions store every channel separately
+            data = data.to_dense().to_sparse(sparse_dim=3)
+        data = data.coalesce()
+        return (data.indices().T, data.values()), protein_dict
+
+    def collate(self, batch, dense=False):
+        """ Collates sparse voxel items (with ``sparse=True``) into a sparse tensor of shape (B, X, Y, Z, C). The first row of its indices is the batch index of each voxel. Use as the ``collate_fn`` of a DataLoader.
+
+        Parameters
+        ----------
+        batch: list
+            A list of ((coords, features), protein_dict) items.
+        dense: bool, default False
+            If `True`, the batch is converted to a dense tensor.
+
+        Returns
+        -------
+        tuple
+            The batched voxels and the list of protein dictionaries.
+        """
+        coords = torch.cat([torch.nn.functional.pad(coords, (1, 0), value=i) for i, ((coords, _), _) in enumerate(batch)])
+        features = torch.cat([features for (_, features), _ in batch])
+        voxels = torch.sparse_coo_tensor(coords.T, features, (len(batch), *self.gridsize, features.shape[-1]), is_coalesced=True)
+        if dense:
+            voxels = voxels.to_dense()
+        return voxels, [protein_dict for _, protein_dict in batch]
+
+    def to_arrays(self, data):
+        data = data.coalesce()
+        return {'indices': data.indices().T.numpy(), 'values': data.values().numpy()}, {'shape': tuple(data.shape)}
+
+    def from_arrays(self, arrays, extras):
+        indices = torch.from_numpy(arrays['indices']).T
+        return torch.sparse_coo_tensor(indices, torch.from_numpy(arrays['values']), extras['shape'], is_coalesced=True)
 
 
 class TorchPointDataset(FrameworkDataset, TorchDataset):
     """ Point dataset for PyTorch.
+
+    With ``storage='collated'``, all point clouds are concatenated into one memory-mapped array and loaded as tensors without copying, such that DataLoader workers share the memory.
     """
 
+    storages = {**FrameworkDataset.storages, 'collated': CollatedStorage}
+
     def convert_to_framework(self, data_item):
         return torch.tensor(data_item.data).float()
+
+    def to_arrays(self, data):
+        return {'points': data.numpy()}, None
+
+    def from_arrays(self, arrays, extras):
+        return torch.from_numpy(arrays['points'])
@@ -1,9 +1,10 @@
 import os
-from sklearn.neighbors import kneighbors_graph, radius_neighbors_graph
+from functools import partial
 from tqdm import tqdm
 import numpy as np
 
-from proteinshake.utils import tokenize, error
+from proteinshake.utils import tokenize, error, stable_hash, laplacian_encoding, random_walk_encoding
+from proteinshake.utils.neighbors import radius_graph, knn_graph, NeighborIndex
 
 class Graph():
     """ Graph representation of a protein.
@@ -13,26 +14,48 @@ class Graph():
     protein: dict
         A protein object.
     construction: str
-        Whether to use knn or eps construction.
+        Whether to use knn or eps construction, to build a :class:`proteinshake.utils.neighbors.NeighborIndex` ('index'), or to keep only the coordinates ('coords').
     eps: float
         The epsilon radius to be used in graph construction (in Angstrom).
     k: int
         The number of neighbors to be used in the k-NN graph.
     weighted_edges: bool, default False
         If `True`, edges are attributed with their euclidean distance. If `False`, edges are unweighted.
+    r_max: float, default None
+        The maximum radius of the neighbor index.
+    k_max: int, default None
+        The maximum number of neighbors of the neighbor index.
+    laplacian_pe: int, default None
+        The number of Laplacian eigenvectors to precompute as node encodings.
+    random_walk_pe: int, default None
+        The number of random walk steps to precompute as node encodings.
+    edge_distances: bool, default False
+        If `True`, the edge lengths are stored for radial basis function encodings, also for unweighted graphs.
 
     """
 
-    def __init__(self, protein, construction, k, eps, weighted_edges):
+    def __init__(self, protein, construction, k, eps, weighted_edges, r_max=None, k_max=None, laplacian_pe=None, random_walk_pe=None, edge_distances=False):
         resolution = 'atom' if 'atom' in protein else 'residue'
-        mode = 'distance' if weighted_edges else 'connectivity'
         coords = np.stack([protein[resolution]['x'], protein[resolution]['y'], protein[resolution]['z']], axis=1)
         nodes = tokenize(protein[resolution][f'{resolution}_type'], resolution=resolution)
         if construction == 'eps':
-            adj = radius_neighbors_graph(coords, radius=eps, mode=mode)
+            adj = radius_graph(coords, eps, weighted=weighted_edges)
         elif construction == 'knn':
             n_neighbors = min(len(coords) - 1, k) # reduce k if protein is smaller than self.k
-            adj = kneighbors_graph(coords,  n_neighbors=n_neighbors, mode=mode)
+            adj = knn_graph(coords, n_neighbors, weighted=weighted_edges)
+        elif construction == 'index':
+            adj = NeighborIndex(coords, r_max=r_max, k_max=k_max)
+        elif construction == 'coords':
+            adj = coords.astype(np.float32)
+        # encodings are stored compactly and converted to float32 when they are loaded
+        self.encodings = {}
+        if not laplacian_pe is None:
+            self.encodings['laplacian_eigenvector_pe'] = laplacian_encoding(adj, laplacian_pe).astype(np.float16)
+        if not random_walk_pe is None:
+            self.encodings['random_walk_pe'] = random_walk_encoding(adj, random_walk_pe).astype(np.float16)
+        if edge_distances:
+            edges = adj.tocoo()
+            self.encodings['edge_distance'] = np.linalg.norm(coords[edges.row] - coords[edges.col], axis=1).astype(np.float32)
         self.protein_dict = protein
         self.resolution = resolution
         self.data = (nodes, adj)
@@ -44,6 +67,22 @@ class GraphDataset():
     """ Graph representation of a protein structure dataset.
     Converts a protein object to a graph by using a k-nearest-neighbor or epsilon-neighborhood approach. Define either `k` or `eps` to determine which one is used.
 
+    If `r_max` or `k_max` is given, a neighbor index with the sorted neighbors of every node up to `r_max` and/or `k_max` is stored instead. The graph for `eps <= r_max` or `k <= k_max` is then sliced out of the index when it is loaded, so graphs with other parameters reuse the same processed dataset.
+
+    .. code-block:: python
+
+        >>> dataset = RCSBDataset().to_graph(eps=6, r_max=12).pyg()
+        >>> wider = RCSBDataset().to_graph(eps=10, r_max=12).pyg() # no processing
+
+    With `on_the_fly=True`, only the node tokens and coordinates are stored and the edges are built when the items are loaded, after `transform`. A DataLoader fetches a whole batch at once, which is then searched with a single neighbor search in the workers of the DataLoader. This saves disk space and keeps graphs consistent with coordinates that are augmented every epoch.
+
+    .. code-block:: python
+
+        >>> dataset = RCSBDataset().to_graph(eps=8, on_the_fly=True).pyg(transform=add_noise)
+        >>> loader = DataLoader(dataset, batch_size=32, collate_fn=dataset.collate, num_workers=4)
+
+    Positional and structural encodings for graph transformers can be precomputed once per protein with `laplacian_pe`, `random_walk_pe` and `edge_rbf`, see :mod:`proteinshake.utils.encodings`. The PyG and DGL datasets expose them as the node attributes `laplacian_eigenvector_pe` and `random_walk_pe` and the edge attribute `edge_rbf`. The node encodings are stored in half precision, and only the edge lengths are stored for the radial basis functions.
+
     Parameters
     ----------
     proteins: generator
@@ -60,28 +99,78 @@ class GraphDataset():
         The number of neighbors to be used in the k-NN graph.
     weighted_edges: bool, default False
         If `True`, edges are attributed with their euclidean distance. If `False`, edges are unweighted.
+    key: str, default None
+        Identifies the proteins, e.g. by the dataset signature and the transform. It is hashed into the path together with the representation parameters, so that variants are cached side by side.
+    r_max: float, default None
+        The maximum radius of the neighbor index. Requires `eps <= r_max` if `eps` is given.
+    k_max: int, default None
+        The maximum number of neighbors of the neighbor index. Requires `k <= k_max` if `k` is given.
+    on_the_fly: bool, default False
+        If `True`, no edges are stored and the graphs are built when items are loaded. Only available for PyG and DGL.
+    laplacian_pe: int, default None
+        The number of Laplacian eigenvectors to precompute as node encodings.
+    random_walk_pe: int, default None
+        The number of random walk steps to precompute as node encodings. Not available at atom resolution, where the cost grows quadratically with the number of atoms.
+    edge_rbf: int, default None
+        The number of radial basis functions to expand the edge lengths into.
+    rbf_cutoff: float, default None
+        The largest center of the radial basis functions. Defaults to `eps`, and is required for k-NN graphs.
 
     """
 
-    def __init__(self, proteins, root, name, resolution='residue', eps=None, k=None, weighted_edges=False, verbosity=2):
+    def __init__(self, proteins, root, name, resolution='residue', eps=None, k=None, weighted_edges=False, key=None, r_max=None, k_max=None, on_the_fly=False, laplacian_pe=None, random_walk_pe=None, edge_rbf=None, rbf_cutoff=None, verbosity=2):
         self.verbosity = verbosity
         if (eps is None and k is None): error('You must specify eps or k in the graph construction.', verbosity=self.verbosity)
         construction = 'knn' if not k is None else 'eps'
         param = k if construction == 'knn' else eps
         weighted = '_weighted' if weighted_edges else ''
-        self.path = f'{root}/processed/graph/{name}_{resolution}_{construction}_{param}{weighted}'
-        self.graphs = (Graph(protein, construction, k, eps, weighted_edges) for protein in proteins)
+        self.proteins = proteins
+        # the graph parameters for datasets which build the graphs on load
+        selection = {'eps': eps if construction == 'eps' else None, 'k': k if construction == 'knn' else None, 'weighted_edges': weighted_edges}
+        self.neighbors = None
+        self.on_the_fly = on_the_fly
+        for param_name, value in [('laplacian_pe', laplacian_pe), ('random_walk_pe', random_walk_pe), ('edge_rbf', edge_rbf)]:
+            if not value is None and (not isinstance(value, (int, np.integer)) or value < 1): error(f'{param_name} must be a positive integer, got {value}.', verbosity=self.verbosity)
+        # only the requested encodings are passed to the representation, so that the paths of datasets without encodings are unchanged
+        encodings = {param_name: value for param_name, value in [('laplacian_pe', laplacian_pe), ('random_walk_pe', random_walk_pe)] if not value is None}
+        if not edge_rbf is None:
+            encodings['edge_distances'] = True
+        self.edge_rbf = None
+        if not edge_rbf is None:
+            if rbf_cutoff is None and construction == 'knn': error('rbf_cutoff is required for radial basis functions of k-NN graphs.', verbosity=self.verbosity)
+            self.edge_rbf = (edge_rbf, eps if rbf_cutoff is None else rbf_cutoff)
+        if not random_walk_pe is None and resolution == 'atom': error('Random walk encodings are not available at atom resolution, their cost grows quadratically with the number of atoms. Use laplacian_pe instead.', verbosity=self.verbosity)
+        if len(encodings) > 0 and (on_the_fly or not r_max is None or not k_max is None): error('Graph encodings can only be precomputed for stored graphs.', verbosity=self.verbosity)
+        if on_the_fly:
+            if not r_max is None or not k_max is None: error('A neighbor index is not needed for on-the-fly graph construction.', verbosity=self.verbosity)
+            self.neighbors = selection
+            self.representation = partial(Graph, construction='coords', k=None, eps=None, weighted_edges=False)
+            self.path = f'{root}/processed/graph/{name}_{resolution}_coords_{stable_hash(key, self.representation)}'
+        elif r_max is None and k_max is None:
+            self.representation = partial(Graph, construction=construction, k=k, eps=eps, weighted_edges=weighted_edges, **encodings)
+            self.path = f'{root}/processed/graph/{name}_{resolution}_{construction}_{param}{weighted}_{stable_hash(key, self.representation)}'
+        else:
+            if construction == 'eps' and (r_max is None or eps > r_max): error(f'eps={eps} requires a neighbor index with r_max >= eps.', verbosity=self.verbosity)
+            if construction == 'knn' and (k_max is None or k > k_max): error(f'k={k} requires a neighbor index with k_max >= k.', verbosity=self.verbosity)
+            self.neighbors = selection
+            self.representation = partial(Graph, construction='index', k=None, eps=None, weighted_edges=False, r_max=r_max, k_max=k_max)
+            self.path = f'{root}/processed/graph/{name}_{resolution}_index_{r_max}_{k_max}_{stable_hash(key, self.representation)}'
         self.size = len(proteins)
         os.makedirs(os.path.dirname(self.path), exist_ok=True)
 
+    @property
+    def graphs(self):
+        return (self.representation(protein) for protein in self.proteins)
+
     def pyg(self, *args, **kwargs):
         from proteinshake.frameworks.pyg import PygGraphDataset
-        return PygGraphDataset(self.graphs, self.size, self.path+'.pyg', verbosity=self.verbosity, *args, **kwargs)
+        return PygGraphDataset(self.proteins, self.size, self.path+'.pyg', representation=self.representation, neighbors=self.neighbors, edge_rbf=self.edge_rbf, verbosity=self.verbosity, *args, **kwargs)
 
     def dgl(self, *args, **kwargs):
         from proteinshake.frameworks.dgl import DGLGraphDataset
-        return DGLGraphDataset(self.graphs, self.size, self.path+'.dgl', verbosity=self.verbosity, *args, **kwargs)
+        return DGLGraphDataset(self.proteins, self.size, self.path+'.dgl', representation=self.representation, neighbors=self.neighbors, edge_rbf=self.edge_rbf, verbosity=self.verbosity, *args, **kwargs)
 
     def nx(self, *args, **kwargs):
         from proteinshake.frameworks.nx import NetworkxGraphDataset
-        return NetworkxGraphDataset(self.graphs, self.size, self.path+'.nx', verbosity=self.verbosity, *args, **kwargs)
+        if self.on_the_fly: error('On-the-fly graph construction is only available for PyG and DGL.', verbosity=self.verbosity)
+        return NetworkxGraphDataset(self.proteins, self.size, self.path+'.nx', representation=self.representation, neighbors=self.neighbors, verbosity=self.verbosity, *args, **kwargs)
@@ -2,7 +2,7 @@ import os
 from tqdm import tqdm
 import numpy as np
 
-from proteinshake.utils import tokenize
+from proteinshake.utils import tokenize, stable_hash
 
 class Point():
     """ Point representation of a protein.
@@ -37,23 +37,30 @@ class PointDataset():
         Path to save the processed dataset.
     resolution: str, default 'residue'
         Resolution of the proteins to use in the graph representation. Can be 'atom' or 'residue'.
+    key: str, default None
+        Identifies the proteins, e.g. by the dataset signature and the transform. It is hashed into the path together with the representation parameters, so that variants are cached side by side.
 
     """
 
-    def __init__(self, proteins, root, name, resolution='residue', verbosity=2):
+    def __init__(self, proteins, root, name, resolution='residue', key=None, verbosity=2):
         self.verbosity = verbosity
-        self.path = f'{root}/processed/point/{name}_{resolution}'
-        self.points = (Point(protein) for protein in proteins)
+        self.path = f'{root}/processed/point/{name}_{resolution}_{stable_hash(key, Point)}'
+        self.proteins = proteins
+        self.representation = Point
         self.size = len(proteins)
 
+    @property
+    def points(self):
+        return (self.representation(protein) for protein in self.proteins)
+
     def torch(self, *args, **kwargs):
         from proteinshake.frameworks.torch import TorchPointDataset
-        return TorchPointDataset(self.points, self.size, self.path+'.torch', verbosity=self.verbosity, *args, **kwargs)
+        return TorchPointDataset(self.proteins, self.size, self.path+'.torch', representation=self.representation, verbosity=self.verbosity, *args, **kwargs)
 
     def tf(self, *args, **kwargs):
         from proteinshake.frameworks.tf import TensorflowPointDataset
-        return TensorflowPointDataset(self.points, self.size, self.path+'.tf', verbosity=self.verbosity, *args, **kwargs)
+        return TensorflowPointDataset(self.proteins, self.size, self.path+'.tf', representation=self.representation, verbosity=self.verbosity, *args, **kwargs)
 
     def np(self, *args, **kwargs):
         from proteinshake.frameworks.np import NumpyPointDataset
-        return NumpyPointDataset(self.points, self.size, self.path+'.np', verbosity=self.verbosity, *args, **kwargs)
+        return NumpyPointDataset(self.proteins, self.size, self.path+'.np', representation=self.representation, verbosity=self.verbosity, *args, **kwargs)
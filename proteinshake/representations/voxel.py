@@ -1,9 +1,10 @@
 import os
 import itertools
+from functools import partial
 from tqdm import tqdm
 import numpy as np
 
-from proteinshake.utils import onehot
+from proteinshake.utils import onehot, stable_hash, save, load, progressbar
 
 class Voxel():
     """ Voxel representation of a protein.
@@ -25,29 +26,22 @@ class Voxel():
         resolution = 'atom' if 'atom' in protein else 'residue'
         self.protein_dict = protein
         self.resolution = resolution
-        labels = onehot(protein[resolution][f'{resolution}_type'])
+        labels = onehot(protein[resolution][f'{resolution}_type'], resolution=resolution)
         coords = np.stack([protein[resolution]['x'], protein[resolution]['y'], protein[resolution]['z']], axis=1)
         coords -= coords.min(axis=0) # translate to make all coords positive and flushed to the axes
         voxel_indices = (coords / voxelsize).astype(np.int32) # rasterize
-        voxels = np.zeros(shape=np.concatenate([voxel_indices.max(axis=0)+1, labels.shape]))
-        counts = np.zeros(shape=np.concatenate([voxel_indices.max(axis=0)+1, labels.shape]))
-        voxel_indices = np.concatenate([voxel_indices, np.expand_dims(np.arange(len(coords)),1)], axis=1)
-        voxels[tuple(voxel_indices.transpose())] = labels
-        if aggregation == 'sum':
-            voxels = voxels.sum(axis=-2)
-        elif aggregation == 'mean':
-            counts[tuple(voxel_indices.transpose())] = np.ones_like(labels)
-            counts = counts.sum(axis=-2)
-            voxels = np.divide(voxels.sum(axis=-2), counts, out=np.zeros_like(counts), where=counts!=0)
-        # trim to gridsize
-        diff = gridsize-voxels.shape[:-1]
-        lower = -((diff < 0) * np.ceil(diff/2)).astype(int)
-        upper = (voxels.shape[:-1] * (diff >= 0) + (diff < 0) * np.floor(diff/2)).astype(int)
-        voxels = voxels[lower[0]:upper[0],lower[1]:upper[1],lower[2]:upper[2]]
-        # pad to gridsize
-        diff = gridsize-voxels.shape[:-1]
-        paddings = np.stack([np.ceil(diff/2), np.floor(diff/2)],1).astype(np.int32)
-        voxels = np.pad(voxels, (*paddings,(0,0)))
+        # accumulate the labels of the occupied voxels only
+        extent = voxel_indices.max(axis=0) + 1
+        occupied, inverse = np.unique(np.ravel_multi_index(voxel_indices.T, extent), return_inverse=True)
+        inverse = inverse.reshape(-1)
+        values = np.stack([np.bincount(inverse, weights=labels[:,c], minlength=len(occupied)) for c in range(labels.shape[1])], axis=1)
+        if aggregation == 'mean':
+            values /= np.bincount(inverse, minlength=len(occupied))[:,None]
+        # center in the grid, cropping the borders if the protein is larger than the grid
+        positions = np.stack(np.unravel_index(occupied, extent), axis=1) + np.ceil((gridsize - extent) / 2).astype(int)
+        inside = ((positions >= 0) & (positions < gridsize)).all(axis=1)
+        voxels = np.zeros((*np.asarray(gridsize, dtype=int), labels.shape[1]))
+        voxels[tuple(positions[inside].T)] = values[inside]
         self.data = voxels
 
 
@@ -68,39 +62,68 @@ class VoxelDataset():
     resolution: str, default 'residue'
         Resolution of the proteins to use in the graph representation. Can be 'atom' or 'residue'.
     gridsize: tuple, default None
-        The size of the grid in voxels as a 3-tuple of x,y,z edge lengths. If None (default), the dimensions of the largest protein in the dataset is used.
+        The size of the grid in voxels as a 3-tuple of x,y,z edge lengths. If None (default), the dimensions of the largest protein in the dataset is used. The extents of the proteins are stored next to the processed datasets and reused. Random transforms should be deterministic per protein, since the proteins are read twice.
     voxelsize: float, default 10
         The size of a voxel (in Angstrom).
     aggregation: str, defaul 'mean'
         How to aggregate labels of a voxel.
+    key: str, default None
+        Identifies the proteins, e.g. by the dataset signature and the transform. It is hashed into the path together with the representation parameters, so that variants are cached side by side.
 
     """
 
-    def __init__(self, proteins, root, name, resolution='residue', gridsize=None, voxelsize=10, aggregation='mean', verbosity=2):
+    def __init__(self, proteins, root, name, resolution='residue', gridsize=None, voxelsize=10, aggregation='mean', key=None, verbosity=2):
         self.verbosity = verbosity
         self.size = len(proteins)
         if gridsize is None:
-            proteins, proteins_copy = itertools.tee(proteins)
-            gridsize = np.array([[
-                np.ptp(protein[resolution]['x']),
-                np.ptp(protein[resolution]['y']),
-                np.ptp(protein[resolution]['z'])
-                ] for protein in proteins_copy]).max(0)
-            gridsize = np.ceil(gridsize/voxelsize).astype(int)
+            extents_path = f'{root}/processed/voxel/{name}_{resolution}_{stable_hash(key)}.extents.npy' if not key is None else None
+            proteins, extents = self.compute_extents(proteins, resolution, extents_path)
+            gridsize = np.ceil(extents.max(0)/voxelsize).astype(int)
         gridsize = np.array(gridsize)
         gridsize_string = '_'.join(str(i) for i in gridsize)
         self.gridsize = gridsize
-        self.voxels = (Voxel(protein, gridsize, voxelsize, aggregation) for protein in proteins)
-        self.path = f'{root}/processed/voxel/{name}_{resolution}_voxelsize_{voxelsize}_gridsize_{gridsize_string}_aggregation_{aggregation}'
+        self.proteins = proteins
+        self.representation = partial(Voxel, gridsize=gridsize, voxelsize=voxelsize, aggregation=aggregation)
+        self.path = f'{root}/processed/voxel/{name}_{resolution}_voxelsize_{voxelsize}_gridsize_{gridsize_string}_aggregation_{aggregation}_{stable_hash(key, self.representation)}'
+
+    def compute_extents(self, proteins, resolution, path=None):
+        """ Computes the extent of every protein along the x, y and z axes, which determines the default gridsize.
+        If `proteins` can be iterated several times (see :class:`proteinshake.utils.io.Generator`), the extents are computed in a separate pass over the coordinates and the proteins are not held in memory. Otherwise, the proteins are buffered until they are voxelized.
+        If `path` is given, the extents are saved and reused.
+
+        Returns
+        -------
+        tuple
+            The proteins (to be iterated again) and an array of shape (n_proteins, 3).
+        """
+        if not path is None and os.path.exists(path):
+            return proteins, load(path)
+        if getattr(proteins, 'restartable', False):
+            proteins_copy = proteins
+        else:
+            proteins, proteins_copy = itertools.tee(proteins)
+        extents = np.array([[
+            np.ptp(protein[resolution]['x']),
+            np.ptp(protein[resolution]['y']),
+            np.ptp(protein[resolution]['z'])
+            ] for protein in progressbar(proteins_copy, desc='Computing grid size', total=self.size, verbosity=self.verbosity)]).reshape(-1, 3)
+        if not path is None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            save(extents, path)
+        return proteins, extents
+
+    @property
+    def voxels(self):
+        return (self.representation(protein) for protein in self.proteins)
 
     def torch(self, *args, **kwargs):
         from proteinshake.frameworks.torch import TorchVoxelDataset
-        return TorchVoxelDataset(self.voxels, self.size, self.path+'.torch', verbosity=self.verbosity, *args, **kwargs)
+        return TorchVoxelDataset(self.proteins, self.size, self.path+'.torch', representation=self.representation, verbosity=self.verbosity, *args, **kwargs)
 
     def tf(self, *args, **kwargs):
         from proteinshake.frameworks.tf import TensorflowVoxelDataset
-        return TensorflowVoxelDataset(self.voxels, self.size, self.path+'.tf', verbosity=self.verbosity, *args, **kwargs)
+        return TensorflowVoxelDataset(self.proteins, self.size, self.path+'.tf', representation=self.representation, verbosity=self.verbosity, *args, **kwargs)
 
     def np(self, *args, **kwargs):
         from proteinshake.frameworks.np import NumpyVoxelDataset
-        return NumpyVoxelDataset(self.voxels, self.size, self.path+'.np', verbosity=self.verbosity, *args, **kwargs)
+        return NumpyVoxelDataset(self.proteins, self.size, self.path+'.np', representation=self.representation, verbosity=self.verbosity, *args, **kwargs)
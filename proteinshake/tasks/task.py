@@ -6,6 +6,7 @@ import numpy as np
 from sklearn.model_selection import train_test_split
 
 from proteinshake.utils import download_url, save, load
+from proteinshake.frameworks.dataset import Subset
 
 class Task:
     """ Base class for task-related utilities.
@@ -175,15 +176,18 @@ class Task:
 
     @property
     def train(self):
-        return self.dataset[self.train_index]
+        """ A lazy view on the training split of the dataset. Items are loaded on access. """
+        return Subset(self.dataset, self.train_index)
 
     @property
     def val(self):
-        return self.dataset[self.val_index]
+        """ A lazy view on the validation split of the dataset. Items are loaded on access. """
+        return Subset(self.dataset, self.val_index)
 
     @property
     def test(self):
-        return self.dataset[self.test_index]
+        """ A lazy view on the test split of the dataset. Items are loaded on access. """
+        return Subset(self.dataset, self.test_index)
 
     def to_graph(self, *args, **kwargs):
         self.dataset = self.dataset.to_graph(*args, **kwargs)
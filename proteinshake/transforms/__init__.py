@@ -5,6 +5,8 @@ __all__ = [
             'Compose',
             'Transform',
             'IdentityTransform',
+            'AffineTransform',
+            'RandomTransform',
             'CenterTransform',
             'RandomRotateTransform',
           ]
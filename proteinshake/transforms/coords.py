@@ -1,11 +1,24 @@
 import numpy as np
 from scipy.spatial.transform import Rotation
 
-from proteinshake.transforms import Transform
+from proteinshake.transforms import Transform, RandomTransform
 
 
+def _coords_base(protein, resolution='residue'):
+    """ Returns the (N, 3) array of which the x, y and z coordinates of the protein are column views, or None.
+    """
+    x, y, z = (protein[resolution][c] for c in 'xyz')
+    base = getattr(x, 'base', None)
+    if not isinstance(base, np.ndarray) or base.ndim != 2 or base.shape != (len(x), 3) or y.base is not base or z.base is not base:
+        return None
+    address = lambda a: a.__array_interface__['data'][0]
+    if not all(address(c) == address(base) + i * base.itemsize and c.strides == base.strides[:1] for i, c in enumerate([x, y, z])):
+        return None
+    return base
+
 def _get_coords_array(protein, resolution='residue'):
-    """ Get a numpy array of the protein coordinates
+    """ Get a numpy array of the protein coordinates.
+    The first call converts the coordinate lists of the protein to a single array, and replaces the x, y and z entries with views on it. Later calls return the same array, so transforms can modify it in place.
 
 
     Arguments
@@ -23,34 +36,111 @@ def _get_coords_array(protein, resolution='residue'):
 
     """
 
-    N = len(protein[resolution]['x'])
+    coords = _coords_base(protein, resolution=resolution)
+    if coords is None:
+        coords = np.stack([protein[resolution]['x'],
+                           protein[resolution]['y'],
+                           protein[resolution]['z']
+                           ], axis=1).astype(np.float64).reshape((-1, 3))
+        _set_views(protein, coords, resolution=resolution)
+    return coords
 
-    return np.array([protein[resolution]['x'],
-                     protein[resolution]['y'],
-                     protein[resolution]['z']
-                     ]
-                   ).T.reshape((N, 3))
+def _set_views(protein, coords, resolution='residue'):
+    protein[resolution]['x'] = coords[:,0]
+    protein[resolution]['y'] = coords[:,1]
+    protein[resolution]['z'] = coords[:,2]
 
-def _set_coords(protein, coord_array, resolution='residue', in_place=True):
-    """ Given an Nx3 array of coordinates, set them to the
-    protein dictionary coord key.
+def pack_coords(proteins, resolution='residue'):
+    """ Concatenates the coordinates of several proteins into one array for batched transforms, see :meth:`proteinshake.transforms.Transform.batch`.
+    The x, y and z entries of the proteins are replaced with views on the packed array, so batched transforms also update the proteins.
 
     Arguments
-    ----------
-    protein: dict
-        Proteinshake protein dict
+    ---------
+    proteins: list
+        A list of protein dictionaries.
     resolution: str
-        Which resolution to use ('residue' or 'atom')
-    coord_array: np.array
-        Nx3 numpy coordinate array
+        The resolution at which to pack the coordinates ('residue', or 'atom')
+
+    Returns
+    --------
+    tuple
+        The coordinates of shape (n_(residues or atoms), 3) and the offsets of the proteins, of length n_proteins + 1.
+    """
+    ptr = np.concatenate([[0], np.cumsum([len(protein[resolution]['x']) for protein in proteins])]).astype(np.int64)
+    coords = np.empty((ptr[-1], 3))
+    for i, protein in enumerate(proteins):
+        for j, c in enumerate('xyz'):
+            coords[ptr[i]:ptr[i+1], j] = protein[resolution][c]
+        _set_views(protein, coords[ptr[i]:ptr[i+1]], resolution=resolution)
+    return coords, ptr
+
+def segment_mean(coords, ptr):
+    """ The mean of every segment of a packed batch. Empty segments have a mean of zero.
+    """
+    counts = np.diff(ptr)
+    segments = np.repeat(np.arange(len(counts)), counts)
+    sums = np.stack([np.bincount(segments, weights=coords[:,j], minlength=len(counts)) for j in range(coords.shape[1])], axis=1)
+    return sums / np.maximum(counts, 1)[:,None]
 
+def _apply_affine_batch(coords, ptr, A, b):
+    """ Applies one affine map per segment in place. A loop over the segments avoids copying the matrices for every point.
     """
+    for i, (start, end) in enumerate(zip(ptr[:-1], ptr[1:])):
+        coords[start:end] = coords[start:end] @ A[i].T + b[i]
+    return coords
 
-    protein[resolution]['x'] = list(map(float,coord_array[:,0]))
-    protein[resolution]['y'] = list(map(float,coord_array[:,1]))
-    protein[resolution]['z'] = list(map(float,coord_array[:,2]))
+class AffineTransform(Transform):
+    """ Base class of transforms which map the coordinates `x` of a protein to `x @ A.T + b`.
+    Subclasses implement :meth:`affine`. Consecutive affine transforms in a :class:`proteinshake.transforms.Compose` are fused into a single matrix multiplication.
+    """
+    resolution = 'residue'
+
+    def affine(self, protein, center):
+        """ Computes the affine map.
+
+        Arguments
+        ----------
+        protein: dict
+            A protein dictionary.
+        center: np.array
+            The mean of the coordinates the map is applied to, which can differ from the stored coordinates when transforms are fused.
+
+        Returns
+        --------
+        tuple
+            The 3x3 matrix `A` and the translation vector `b`.
+        """
+        raise NotImplementedError
+
+    def affine_batch(self, centers, keys=None):
+        """ Computes one affine map per protein of a batch.
+
+        Arguments
+        ----------
+        centers: np.array
+            The means of the coordinates of every protein, of shape (n_proteins, 3).
+        keys: list, default None
+            Integer keys of the proteins, for random transforms.
+
+        Returns
+        --------
+        tuple
+            The matrices of shape (n_proteins, 3, 3) and the translation vectors of shape (n_proteins, 3).
+        """
+        maps = [self.affine(None, center) for center in centers]
+        return np.array([A for A, _ in maps]).reshape(-1, 3, 3), np.array([b for _, b in maps]).reshape(-1, 3)
 
-class CenterTransform(Transform):
+    def __call__(self, protein):
+        coords = _get_coords_array(protein, resolution=self.resolution)
+        A, b = self.affine(protein, coords.mean(axis=0))
+        coords[:] = coords @ A.T + b
+        return protein
+
+    def batch(self, coords, ptr, keys=None):
+        A, b = self.affine_batch(segment_mean(coords, ptr), keys=keys)
+        return _apply_affine_batch(coords, ptr, A, b)
+
+class CenterTransform(AffineTransform):
     """ Center the coordinates of a protein at atom and residue level.
     We use the Ca to compute the center for all the atoms.
         """
@@ -58,32 +148,22 @@ class CenterTransform(Transform):
         self.resolution = resolution
         super().__init__()
 
-    def __call__(self, protein):
-        coords = _get_coords_array(protein, resolution=self.resolution)
-
-        center = np.mean(coords, axis=0)
-        new_coords = coords - center
+    def affine(self, protein, center):
+        return np.eye(3), -center
 
-        _set_coords(protein, new_coords, resolution=self.resolution)
+    def affine_batch(self, centers, keys=None):
+        return np.broadcast_to(np.eye(3), (len(centers), 3, 3)), -centers
 
-        return protein
-
-class RandomRotateTransform(Transform):
-    """ Apply a random rotation to the coordinate arrays of a protein"""
+class RandomRotateTransform(RandomTransform, AffineTransform):
+    """ Apply a random rotation to the coordinate arrays of a protein. The rotation of a protein is reproducible, see :class:`proteinshake.transforms.RandomTransform`."""
 
     def __init__(self, resolution='residue', seed=42):
-        self.seed = seed
         self.resolution = resolution
-        np.random.seed(self.seed)
-        super().__init__()
-        pass
-
-    def __call__(self, protein):
-        coords = _get_coords_array(protein, resolution=self.resolution)
-        rotation = Rotation.random()
-        rotated_coordinates = rotation.apply(coords)
-        rotation_matrix = rotation.as_matrix()
+        super().__init__(seed=seed)
 
-        _set_coords(protein, rotated_coordinates, resolution=self.resolution)
+    def affine(self, protein, center):
+        return Rotation.random(random_state=self.rng(protein)).as_matrix(), np.zeros(3)
 
-        return protein
+    def affine_batch(self, centers, keys=None):
+        rotations = np.array([Rotation.random(random_state=rng).as_matrix() for rng in self.batch_rngs(keys)])
+        return rotations.reshape(-1, 3, 3), np.zeros_like(centers)
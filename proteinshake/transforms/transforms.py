@@ -1,6 +1,9 @@
 """
 Abstract class for transforming a protein.
 """
+import numpy as np
+
+from proteinshake.utils import item_key, item_rng
 
 class Transform:
     """ A callable object which accepts a protein dictionary and returns an updated version of it."""
@@ -18,21 +21,117 @@ class Transform:
         """
         raise NotImplementedError
 
+    def batch(self, coords, ptr, keys=None):
+        """ Transforms the coordinates of a packed batch of proteins in place, see :func:`proteinshake.transforms.coords.pack_coords`.
+
+        Arguments
+        ----------
+        coords: np.array
+            The concatenated coordinates of all proteins, of shape (n_(residues or atoms), 3).
+        ptr: np.array
+            The offsets of the proteins in `coords`, of length n_proteins + 1.
+        keys: list, default None
+            Integer keys of the proteins (see :func:`proteinshake.utils.item_key`), which determine the random numbers of random transforms. Required by random transforms.
+
+        """
+        raise NotImplementedError(f'{type(self).__name__} does not support batches.')
+
+class RandomTransform(Transform):
+    """ Base class of random transforms. Every protein gets its own random number generator, derived from the seed, the protein ID and the epoch (see :func:`proteinshake.utils.item_rng`).
+    The result for a protein is therefore the same in every process and independent of the order of the proteins, so augmentation can run in parallel workers and still be reproduced.
+    Use different seeds for several random transforms of the same kind.
+
+    Arguments
+    ----------
+    seed: int, default 42
+        The random seed.
+    """
+    def __init__(self, seed=42):
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        """ Sets the epoch, to draw different random numbers for the same protein in every epoch. """
+        self.epoch = epoch
+
+    def rng(self, protein):
+        """ The random number generator of a protein. """
+        return item_rng(self.seed, item_key(protein), self.epoch)
+
+    def batch_rngs(self, keys):
+        """ The random number generators of the proteins of a batch. The keys are required, since any state of the transform itself would be duplicated in parallel workers. """
+        if keys is None:
+            raise ValueError(f'{type(self).__name__} requires the keys of the proteins in a batch, see proteinshake.utils.item_key.')
+        return [item_rng(self.seed, key, self.epoch) for key in keys]
+
 class IdentityTransform:
     """ Do nothing to the protein"""
     def __call__(self, protein):
         return protein
 
+    def batch(self, coords, ptr, keys=None):
+        return coords
+
 class Compose:
+    """ Applies several transforms in sequence. Consecutive affine transforms (e.g. centering and rotation) on the same resolution are fused into one matrix multiplication. """
 
     def __init__(self, transforms):
         self.transforms = transforms
 
-    def __call__(self, data):
+    def groups(self):
+        """ Splits the transforms into groups of consecutive affine transforms on the same resolution, and single other transforms. """
+        from proteinshake.transforms.coords import AffineTransform
+        i = 0
+        while i < len(self.transforms):
+            group = [self.transforms[i]]
+            while isinstance(group[0], AffineTransform) and i + len(group) < len(self.transforms):
+                transform = self.transforms[i + len(group)]
+                if not isinstance(transform, AffineTransform) or transform.resolution != group[0].resolution:
+                    break
+                group.append(transform)
+            yield group
+            i += len(group)
+
+    def set_epoch(self, epoch):
+        """ Sets the epoch of all random transforms. """
         for transform in self.transforms:
-            data = transform(data)
+            if hasattr(transform, 'set_epoch'):
+                transform.set_epoch(epoch)
+
+    def __call__(self, data):
+        for group in self.groups():
+            data = self.fuse(group, data) if len(group) > 1 else group[0](data)
         return data
 
+    def fuse(self, transforms, protein):
+        """ Applies a sequence of affine transforms with a single matrix multiplication. """
+        from proteinshake.transforms.coords import _get_coords_array
+        coords = _get_coords_array(protein, resolution=transforms[0].resolution)
+        A, b = np.eye(3), np.zeros(3)
+        center = coords.mean(axis=0)
+        for transform in transforms:
+            A_t, b_t = transform.affine(protein, center)
+            A, b = A_t @ A, b @ A_t.T + b_t
+            center = center @ A_t.T + b_t
+        coords[:] = coords @ A.T + b
+        return protein
+
+    def batch(self, coords, ptr, keys=None):
+        """ Applies the transforms to a packed batch, fusing consecutive affine transforms. See :meth:`Transform.batch`. """
+        from proteinshake.transforms.coords import segment_mean, _apply_affine_batch
+        for group in self.groups():
+            if len(group) == 1:
+                coords = group[0].batch(coords, ptr, keys=keys)
+                continue
+            center = segment_mean(coords, ptr)
+            A, b = np.broadcast_to(np.eye(3), (len(center), 3, 3)), np.zeros_like(center)
+            for transform in group:
+                A_t, b_t = transform.affine_batch(center, keys=keys)
+                A, b = A_t @ A, np.einsum('bij,bj->bi', A_t, b) + b_t
+                center = np.einsum('bij,bj->bi', A_t, center) + b_t
+            coords = _apply_affine_batch(coords, ptr, A, b)
+        return coords
+
     def __repr__(self):
         args = [f'  {transform}' for transform in self.transforms]
-        return '{}([\n{}\n])'.format(self.__class__.__name__, ',\n'.join(args))
\ No newline at end of file
+        return '{}([\n{}\n])'.format(self.__class__.__name__, ',\n'.join(args))
@@ -2,6 +2,9 @@ from .embeddings import *
 from .io import *
 from .similarity import *
 from .uniprot import *
+from .cache import CacheManager
+from .rng import item_key, item_rng
+from .encodings import laplacian_encoding, random_walk_encoding, rbf_encoding
 
 __all__ = ['onehot',
            'tokenize',
@@ -16,7 +19,13 @@ __all__ = ['onehot',
            'write_avro',
            'uniprot_query',
            'uniprot_map',
-           'protein_to_pdb'
+           'protein_to_pdb',
+           'CacheManager',
+           'item_key',
+           'item_rng',
+           'laplacian_encoding',
+           'random_walk_encoding',
+           'rbf_encoding'
            ]
 
 classes = __all__
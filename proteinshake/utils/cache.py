@@ -0,0 +1,164 @@
+"""
+Bookkeeping and eviction of the processed representations in `{root}/processed`.
+Can also be used from the command line:
+
+.. code-block:: console
+
+    $ python -m proteinshake cache list data/processed
+    $ python -m proteinshake cache prune data/processed --budget 50G
+"""
+
+import os
+import time
+import json
+
+UNITS = {'': 1, 'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+
+def parse_size(size):
+    """ Converts a size like 500M or 20G to bytes.
+
+    Parameters
+    ----------
+    size: int or str
+        The size in bytes, or with a unit suffix K, M, G or T.
+
+    Returns
+    -------
+    int
+        The size in bytes.
+    """
+    if isinstance(size, str):
+        size = size.strip().upper().rstrip('B')
+        unit = size[-1] if size[-1:] in UNITS else ''
+        return int(float(size[:len(size)-len(unit)]) * UNITS[unit])
+    return int(size)
+
+def format_size(size):
+    for unit in ['', 'K', 'M', 'G']:
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = 'T'
+    return f'{size:.1f}{unit}B'
+
+
+class CacheManager():
+    """ Records the size and last access time of every processed framework dataset below a directory, and evicts the least recently used ones to stay within a disk budget.
+    An entry is a directory which contains a completed framework dataset. Its metadata is kept in a `cache.json` file inside the entry.
+
+    .. code-block:: python
+
+        >>> from proteinshake.utils import CacheManager
+        >>> cache = CacheManager('data/processed')
+        >>> cache.list()
+        >>> cache.prune('50G')
+
+    Parameters
+    ----------
+    root: str
+        The directory which contains the entries, usually `{root}/processed`.
+    """
+
+    marker = 'transforms.pkl' # written last by FrameworkDataset
+    metadata = 'cache.json'
+
+    def __init__(self, root):
+        self.root = root
+
+    @staticmethod
+    def entry_size(path):
+        """ The size of the files of an entry in bytes. Subdirectories are separate entries (e.g. variants) and are not counted.
+        """
+        return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file(follow_symlinks=False))
+
+    @classmethod
+    def touch(cls, path, size=None):
+        """ Updates the last access time of an entry. The size is computed if it is not given and not yet known.
+        """
+        file = f'{path}/{cls.metadata}'
+        meta = cls.read_metadata(path)
+        if not size is None:
+            meta['size'] = size
+        elif not 'size' in meta:
+            meta['size'] = cls.entry_size(path)
+        meta['last_access'] = time.time()
+        try:
+            with open(f'{file}.{os.getpid()}.tmp', 'w') as handle:
+                json.dump(meta, handle)
+            os.replace(f'{file}.{os.getpid()}.tmp', file)
+        except OSError: # e.g. read-only shared volumes
+            pass
+        return meta
+
+    @classmethod
+    def read_metadata(cls, path):
+        try:
+            with open(f'{path}/{cls.metadata}', 'r') as handle:
+                return json.load(handle)
+        except (OSError, ValueError):
+            return {}
+
+    def list(self):
+        """ Lists the entries, least recently used first.
+
+        Returns
+        -------
+        list
+            A list of dictionaries with the `path`, `size` in bytes and `last_access` time of every entry.
+        """
+        entries = []
+        for path, _, files in os.walk(self.root):
+            if not self.marker in files:
+                continue
+            meta = self.read_metadata(path)
+            entries.append({
+                'path': path,
+                'size': meta['size'] if 'size' in meta else self.entry_size(path),
+                'last_access': meta['last_access'] if 'last_access' in meta else os.path.getmtime(f'{path}/{self.marker}'),
+            })
+        return sorted(entries, key=lambda entry: entry['last_access'])
+
+    def size(self):
+        """ The total size of all entries in bytes.
+        """
+        return sum(entry['size'] for entry in self.list())
+
+    def remove(self, path):
+        """ Deletes an entry. Variants in subdirectories are kept.
+        """
+        for entry in os.scandir(path):
+            if entry.is_file(follow_symlinks=False):
+                os.remove(entry.path)
+        if len(os.listdir(path)) == 0:
+            os.rmdir(path)
+
+    def prune(self, budget, keep=None):
+        """ Removes the least recently used entries until the total size is within the budget.
+
+        Parameters
+        ----------
+        budget: int or str
+            The disk budget in bytes, or with a unit suffix, e.g. '50G'.
+        keep: list, default None
+            Paths of entries which are never removed, e.g. the ones currently in use.
+
+        Returns
+        -------
+        list
+            The removed entries.
+        """
+        budget = parse_size(budget)
+        keep = set(os.path.abspath(path) for path in (keep or ()))
+        entries = self.list()
+        total = sum(entry['size'] for entry in entries)
+        removed = []
+        for entry in entries:
+            if total <= budget:
+                break
+            if os.path.abspath(entry['path']) in keep:
+                continue
+            self.remove(entry['path'])
+            total -= entry['size']
+            removed.append(entry)
+        return removed
@@ -9,6 +9,30 @@ import numpy as np
 residue_alphabet = 'ARNDCEQGHILKMFPSTWYV'
 atom_alphabet = 'NCOSH'
 
+def _lookup_table(alphabet):
+    """ Maps unicode code points < 256 to the index of the character in the alphabet, or -1.
+    """
+    table = np.full(256, -1, dtype=np.int64)
+    table[[ord(c) for c in alphabet]] = np.arange(len(alphabet))
+    return table
+
+_lookup_tables = {'residue': _lookup_table(residue_alphabet), 'atom': _lookup_table(atom_alphabet)}
+
+def _lookup(sequence, resolution='residue'):
+    """ Tokenizes the first character of every element of the sequence with a lookup table.
+    """
+    if isinstance(sequence, str):
+        codes = np.frombuffer(sequence.encode('utf-32-le'), dtype=np.uint32)
+    else:
+        # truncating to one character gives the code point of the first character, e.g. of atom names
+        codes = np.asarray(sequence, dtype='U1').view(np.uint32).reshape(-1)
+    resolution = 'residue' if resolution == 'residue' else 'atom'
+    tokens = _lookup_tables[resolution][np.where(codes < 256, codes, 0)]
+    if (tokens < 0).any():
+        alphabet = residue_alphabet if resolution == 'residue' else atom_alphabet
+        raise ValueError(f'{chr(codes[np.argmax(tokens < 0)])} is not in the {resolution} alphabet {alphabet}.')
+    return tokens
+
 def onehot(sequence, resolution='residue'):
     """ Compute the one-hot encoding of a protein sequence.
 
@@ -24,10 +48,8 @@ def onehot(sequence, resolution='residue'):
     ndarray
         The embedded sequence.
     """
-    if resolution == 'residue':
-        return np.stack([np.eye(len(residue_alphabet))[residue_alphabet.index(aa)] for aa in sequence])
-    else:
-        return np.stack([np.eye(len(atom_alphabet))[atom_alphabet.index(aa[0])] for aa in sequence])
+    alphabet = residue_alphabet if resolution == 'residue' else atom_alphabet
+    return np.eye(len(alphabet))[_lookup(sequence, resolution)]
 
 
 
@@ -46,28 +68,24 @@ def tokenize(sequence, resolution='residue'):
     ndarray
         The embedded sequence.
     """
-    if resolution == 'residue':
-        return np.array([residue_alphabet.index(aa) for aa in sequence])
-    else:
-        return np.array([atom_alphabet.index(aa[0]) for aa in sequence])
+    return _lookup(sequence, resolution)
 
 # from: https://gist.github.com/foowaa/5b20aebd1dff19ee024b6c72e14347bb
 def sinusoid_encoding_table(n_position, d_hid, padding_idx=None):
     """ Helper function to build a sinusoidal lookup table for positional encodings.
     """
-    def cal_angle(position, hid_idx):
-        return position / np.power(10000, 2 * (hid_idx // 2) / d_hid)
-    def get_posi_angle_vec(position):
-        return [cal_angle(position, hid_j) for hid_j in range(d_hid)]
-    sinusoid_table = np.array([get_posi_angle_vec(pos_i) for pos_i in range(n_position)])
-    sinusoid_table[:, 0::2] = np.sin(sinusoid_table[:, 0::2])
-    sinusoid_table[:, 1::2] = np.cos(sinusoid_table[:, 1::2])
+    angles = np.arange(n_position)[:,None] / np.power(10000, 2 * (np.arange(d_hid) // 2) / d_hid)
+    sinusoid_table = np.empty((n_position, d_hid))
+    sinusoid_table[:, 0::2] = np.sin(angles[:, 0::2])
+    sinusoid_table[:, 1::2] = np.cos(angles[:, 1::2])
     if padding_idx is not None:
         sinusoid_table[padding_idx] = 0.
     return sinusoid_table
 
+_sinusoid_tables = {}
+
 def positional_encoding(sequence, dim=128):
-    """ Sinusoidal encoding of sequence position.
+    """ Sinusoidal encoding of sequence position. The table is computed once per dimension and grown when a longer sequence is encoded.
 
     Parameters
     ----------
@@ -80,8 +98,11 @@ def positional_encoding(sequence, dim=128):
         The embedded sequence.
     """
     n = len(sequence)
-    table = sinusoid_encoding_table(n, dim)
-    return table
+    table = _sinusoid_tables.get(dim)
+    if table is None or len(table) < n:
+        table = sinusoid_encoding_table(max(1024, 2**int(np.ceil(np.log2(max(n, 1))))), dim)
+        _sinusoid_tables[dim] = table
+    return table[:n].copy()
 
 def compose_embeddings(embeddings):
     """ Composes multiple embeddings into one by concatenating the results.
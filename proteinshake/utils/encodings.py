@@ -0,0 +1,117 @@
+"""
+Positional and structural encodings of graphs, as used by graph transformers. The graphs are sparse adjacency matrices as returned by :mod:`proteinshake.utils.neighbors`.
+Unlike the sequence embeddings, the encodings depend on the edges of a graph and are precomputed by :class:`proteinshake.representations.GraphDataset`.
+"""
+
+import numpy as np
+from scipy.sparse import csr_matrix, diags
+from scipy.sparse.linalg import eigsh
+
+def _symmetric(adj):
+    """ The unweighted, undirected version of a graph without self loops.
+    """
+    adj = csr_matrix(adj, dtype=np.float64, copy=True)
+    adj.data[:] = 1
+    adj = ((adj + adj.T) > 0).astype(np.float64)
+    adj.setdiag(0)
+    adj.eliminate_zeros()
+    return adj
+
+def _normalized_adjacency(adj):
+    """ The symmetric normalized adjacency matrix D^-1/2 A D^-1/2 of the undirected graph. Isolated nodes have zero rows.
+    """
+    adj = _symmetric(adj)
+    degree = np.asarray(adj.sum(axis=1)).reshape(-1)
+    scale = diags(np.divide(1, np.sqrt(degree), out=np.zeros(len(degree)), where=degree > 0))
+    return (scale @ adj @ scale).tocsr()
+
+def laplacian_encoding(adj, k):
+    """ The eigenvectors of the `k` smallest non-trivial eigenvalues of the symmetric normalized graph Laplacian. Edge directions and weights are ignored.
+    The sign of every eigenvector is fixed such that its largest entry in absolute value is positive, to make the encoding deterministic.
+    The eigenvectors are computed with a sparse eigensolver as the ones of the largest eigenvalues of the normalized adjacency matrix, which takes about a second for 20000 nodes.
+
+    Parameters
+    ----------
+    adj: scipy.sparse.csr_matrix
+        The adjacency matrix of shape (n, n).
+    k: int
+        The number of eigenvectors. Graphs with `n <= k` nodes are padded with zeros.
+
+    Returns
+    -------
+    ndarray
+        The encoding of shape (n, k).
+    """
+    normalized = _normalized_adjacency(adj)
+    n = normalized.shape[0]
+    encoding = np.zeros((n, k))
+    if n < 2:
+        return encoding
+    m = min(k + 1, n)
+    if n < 128: # small graphs are solved directly, the sparse solver requires m < n
+        _, vectors = np.linalg.eigh(normalized.toarray())
+        vectors = vectors[:,-m:]
+    else:
+        # a fixed start vector makes the solver deterministic
+        _, vectors = eigsh(normalized, k=m, which='LA', v0=np.random.default_rng(0).uniform(size=n))
+    # the eigenvalues of the Laplacian are one minus the ones of the normalized adjacency, drop the trivial eigenvector
+    vectors = vectors[:,::-1][:,1:]
+    signs = np.sign(vectors[np.abs(vectors).argmax(axis=0), np.arange(m - 1)])
+    encoding[:,:m-1] = vectors * np.where(signs == 0, 1, signs)
+    return encoding
+
+def random_walk_encoding(adj, steps, block_size=256):
+    """ The probabilities of a random walk to return to its start node after 1 to `steps` steps. Edge directions and weights are ignored.
+    The return probabilities are the diagonal of the powers of the normalized adjacency matrix N, which are computed for blocks of start nodes with sparse matrix products. Since N is symmetric, the diagonal of N^(2a) and N^(2a+1) follows from N^a, which halves the number of products.
+    The cost grows with the number of nodes times the size of their `steps / 2`-hop neighborhoods, which is quadratic for large atom graphs.
+
+    Parameters
+    ----------
+    adj: scipy.sparse.csr_matrix
+        The adjacency matrix of shape (n, n).
+    steps: int
+        The number of steps.
+    block_size: int, default 256
+        The number of start nodes per block, which bounds the memory to n * block_size values.
+
+    Returns
+    -------
+    ndarray
+        The encoding of shape (n, steps).
+    """
+    normalized = _normalized_adjacency(adj).astype(np.float32)
+    n = normalized.shape[0]
+    encoding = np.zeros((n, steps))
+    for start in range(0, n, block_size):
+        end = min(n, start + block_size)
+        walk = np.zeros((n, end - start), dtype=np.float32)
+        walk[np.arange(start, end), np.arange(end - start)] = 1
+        for step in range(1, steps + 1):
+            if step % 2 == 1:
+                following = normalized @ walk
+                encoding[start:end,step-1] = np.einsum('ij,ij->j', walk, following)
+            else:
+                walk = following
+                encoding[start:end,step-1] = np.einsum('ij,ij->j', walk, walk)
+    return encoding
+
+def rbf_encoding(distances, bins, cutoff):
+    """ Expands distances into Gaussian radial basis functions with centers evenly spaced from 0 to `cutoff`.
+
+    Parameters
+    ----------
+    distances: ndarray
+        The distances, e.g. the edge lengths of a graph.
+    bins: int
+        The number of basis functions.
+    cutoff: float
+        The largest center, e.g. the radius of a radius graph.
+
+    Returns
+    -------
+    ndarray
+        The encoding of shape (len(distances), bins).
+    """
+    centers = np.linspace(0, cutoff, bins)
+    width = cutoff / max(bins - 1, 1)
+    return np.exp(-((np.asarray(distances).reshape(-1, 1) - centers) / width) ** 2)
@@ -10,6 +10,10 @@ import gzip
 import shutil
 import requests
 import re
+import types
+import inspect
+import hashlib
+import functools
 import warnings
 import pandas as pd
 import numpy as np
@@ -36,14 +40,23 @@ def error(message, verbosity=2):
     if verbosity > -2: raise Exception(message)
 
 class Generator(object):
+    """ A generator with a length. If `generator` is a function which returns a generator, every iteration starts from the beginning, which allows several passes without buffering the items.
+    """
     def __init__(self, generator, length):
-        self.generator = generator
+        self.factory = generator if callable(generator) else None
+        self.generator = generator() if callable(generator) else generator
         self.length = length
 
     def __len__(self): 
         return self.length
 
+    @property
+    def restartable(self):
+        return not self.factory is None
+
     def __iter__(self):
+        if self.restartable:
+            return self.factory()
         return self.generator
 
     def __next__(self):
@@ -64,6 +77,77 @@ def fx2str(fx):
     """
     return re.sub('(<.*?)\\s.*(>)', r'\1\2', fx.__repr__())
 
+def stable_repr(obj, _seen=None):
+    """ Converts an object to a string which is stable across processes and sessions, unlike `repr` which contains memory addresses.
+    Functions are represented by their name, byte code, constants and closure, other objects by their class and attributes.
+
+    Parameters
+    ----------
+    obj:
+        Any object, e.g. a transform.
+
+    Returns
+    -------
+    str
+        The representation of the object.
+    """
+    _seen = set() if _seen is None else _seen
+    if obj is None or isinstance(obj, (bool, int, float, complex, str, bytes)):
+        return repr(obj)
+    if id(obj) in _seen:
+        return '<cycle>'
+    _seen = _seen | {id(obj)}
+    r = lambda x: stable_repr(x, _seen)
+    name = lambda x: f'{getattr(x, "__module__", None)}.{getattr(x, "__qualname__", type(x).__qualname__)}'
+    if isinstance(obj, (list, tuple)):
+        return f'{type(obj).__name__}({",".join(r(x) for x in obj)})'
+    if isinstance(obj, (set, frozenset)):
+        return f'{type(obj).__name__}({",".join(sorted(r(x) for x in obj))})'
+    if isinstance(obj, dict):
+        return '{' + ','.join(sorted(f'{r(k)}:{r(v)}' for k, v in obj.items())) + '}'
+    if isinstance(obj, np.ndarray):
+        return f'ndarray({obj.dtype},{obj.shape},{hashlib.sha256(np.ascontiguousarray(obj).tobytes()).hexdigest()})'
+    if isinstance(obj, np.generic):
+        return repr(obj.item())
+    if isinstance(obj, functools.partial):
+        return f'partial({r(obj.func)},{r(obj.args)},{r(obj.keywords)})'
+    if isinstance(obj, type):
+        return name(obj)
+    if isinstance(obj, types.CodeType):
+        return f'code({hashlib.sha256(obj.co_code).hexdigest()},{r(obj.co_consts)},{r(obj.co_names)})'
+    if inspect.ismethod(obj):
+        return f'{r(obj.__self__)}.{obj.__name__}'
+    if inspect.isfunction(obj):
+        closure = []
+        for cell in obj.__closure__ or []:
+            try:
+                closure.append(cell.cell_contents)
+            except ValueError: # empty cell
+                closure.append(None)
+        return f'{name(obj)}({r(obj.__code__)},{r(obj.__defaults__)},{r(closure)})'
+    if inspect.isbuiltin(obj) or inspect.ismodule(obj):
+        return name(obj) if not inspect.ismodule(obj) else obj.__name__
+    if hasattr(obj, '__dict__'):
+        return f'{name(type(obj))}({r(vars(obj))})'
+    return fx2str(obj)
+
+def stable_hash(*objects, length=12):
+    """ Hashes objects based on their :func:`stable_repr`, e.g. to derive the cache key of a processed dataset.
+
+    Parameters
+    ----------
+    objects:
+        The objects to hash.
+    length: int, default 12
+        The number of hex digits to return.
+
+    Returns
+    -------
+    str
+        The hex digest.
+    """
+    return hashlib.sha256(stable_repr(objects).encode('utf-8')).hexdigest()[:length]
+
 def avro_schema_from_protein(protein):
     """ Guesses the avro schema from a dictionary.
 
@@ -83,6 +167,8 @@ def avro_schema_from_protein(protein):
             return {'name':k, 'type':{'name':k, 'type':'record', 'fields': [field_spec(_k,_v) for _k,_v in v.items()]}}
         elif type(v) == list:
             return {'name':k, 'type':{'type': 'array', 'items': typedict[type(v[0]).__name__] if len(v)>0 else 'string'}}
+        elif isinstance(v, np.ndarray) and v.ndim == 1: # e.g. coordinates after a transform
+            return {'name':k, 'type':{'type': 'array', 'items': typedict[{'f':'float', 'i':'int', 'u':'int', 'U':'str', 'b':'bool'}[v.dtype.kind]]}}
         elif type(v).__name__ in typedict:
             return {'name':k, 'type': typedict[type(v).__name__]}
         else:
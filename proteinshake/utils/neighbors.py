@@ -0,0 +1,206 @@
+"""
+Neighbor search for graph construction, based on a KD-tree. The graphs are returned as sparse adjacency matrices in CSR format, like the graphs of scikit-learn.
+"""
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.spatial import cKDTree
+
+def _separate(coords, batch, gap):
+    """ Appends the batch index as a fourth coordinate, scaled such that points of different graphs are farther apart than `gap`. Distances within a graph are unchanged.
+    """
+    return np.concatenate([coords, np.asarray(batch, dtype=np.float64)[:,None] * (gap + 1)], axis=1)
+
+def radius_graph(coords, eps, weighted=False, batch=None):
+    """ Connects all pairs of points within a distance of `eps` (inclusive). Points are not connected to themselves.
+    Each pair is found once by the KD-tree pair search, which grows linearly with the number of points for a fixed density as in proteins. It is faster than parallel per-point queries, which find every pair twice.
+
+    Parameters
+    ----------
+    coords: ndarray
+        The coordinates, of shape (n, 3).
+    eps: float
+        The radius.
+    weighted: bool, default False
+        If `True`, the values of the adjacency matrix are the euclidean distances. Otherwise they are 1.
+    batch: ndarray, default None
+        The graph index of every point, if the points of several graphs are searched at once. Points of different graphs are never connected.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        The adjacency matrix of shape (n, n).
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    n = len(coords)
+    if not batch is None:
+        coords = _separate(coords, batch, eps)
+    pairs = cKDTree(coords).query_pairs(eps, output_type='ndarray')
+    rows = np.concatenate([pairs[:,0], pairs[:,1]])
+    cols = np.concatenate([pairs[:,1], pairs[:,0]])
+    values = np.linalg.norm(coords[rows] - coords[cols], axis=1) if weighted else np.ones(len(rows))
+    return csr_matrix((values, (rows, cols)), shape=(n, n))
+
+def knn_graph(coords, k, weighted=False, workers=1, batch=None):
+    """ Connects every point to its `k` nearest neighbors, not counting the point itself. The graph is directed.
+
+    Parameters
+    ----------
+    coords: ndarray
+        The coordinates, of shape (n, 3).
+    k: int
+        The number of neighbors. Must be smaller than n.
+    weighted: bool, default False
+        If `True`, the values of the adjacency matrix are the euclidean distances. Otherwise they are 1.
+    workers: int, default 1
+        The number of threads for the queries. -1 uses all cores.
+    batch: ndarray, default None
+        The graph index of every point, if the points of several graphs are searched at once. Points of different graphs are never connected, and points of graphs with `k` or fewer points are connected to all other points of their graph.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        The adjacency matrix of shape (n, n).
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    n = len(coords)
+    if k <= 0 or n == 0:
+        return csr_matrix((n, n))
+    if not batch is None:
+        batch = np.asarray(batch)
+        coords = _separate(coords, batch, np.linalg.norm(coords.max(axis=0) - coords.min(axis=0)))
+    k_query = min(k + 1, n)
+    distances, indices = cKDTree(coords).query(coords, k=k_query, workers=workers)
+    distances, indices = distances.reshape(n, k_query), indices.reshape(n, k_query)
+    # drop the point itself, or the farthest neighbor if duplicates of the point displaced it
+    keep = indices != np.arange(n)[:,None]
+    keep &= np.cumsum(keep, axis=1) <= k
+    if batch is None:
+        values = distances[keep] if weighted else np.ones(n * k)
+        return csr_matrix((values, indices[keep], np.arange(0, n*k+1, k)), shape=(n, n))
+    # small graphs reach into other graphs
+    keep &= batch[indices] == batch[:,None]
+    values = distances[keep] if weighted else np.ones(keep.sum())
+    return csr_matrix((values, indices[keep], np.concatenate([[0], np.cumsum(keep.sum(axis=1))])), shape=(n, n))
+
+def batched_graphs(coords, ptr, eps=None, k=None, weighted=False, workers=1):
+    """ Builds the radius graphs (if `eps` is given) or k-NN graphs of several point sets with one neighbor search, e.g. for a batch in a collate function.
+    The graphs are the same as the ones of :func:`radius_graph` and :func:`knn_graph` for each point set, with `k` reduced for small sets.
+
+    Parameters
+    ----------
+    coords: ndarray
+        The concatenated coordinates of all point sets, of shape (n, 3).
+    ptr: ndarray
+        The offsets of the point sets in `coords`, of length n_sets + 1.
+    eps: float, default None
+        The radius.
+    k: int, default None
+        The number of neighbors, if `eps` is not given.
+    weighted: bool, default False
+        If `True`, the edge values are the euclidean distances. Otherwise they are 1.
+    workers: int, default 1
+        The number of threads for the k-NN queries.
+
+    Returns
+    -------
+    list
+        The sources, targets and values of the edges of every point set, indexed within the set.
+    """
+    ptr = np.asarray(ptr, dtype=np.int64)
+    batch = np.repeat(np.arange(len(ptr) - 1), np.diff(ptr))
+    if not eps is None:
+        adj = radius_graph(coords, eps, weighted=weighted, batch=batch)
+    else:
+        adj = knn_graph(coords, k, weighted=weighted, workers=workers, batch=batch)
+    adj = adj.tocoo()
+    split = np.searchsorted(adj.row, ptr)
+    return [(adj.row[a:b] - ptr[i], adj.col[a:b] - ptr[i], adj.data[a:b]) for i, (a, b) in enumerate(zip(split[:-1], split[1:]))]
+
+def neighbor_mask(distances, ranks, eps=None, k=None):
+    """ Selects the edges of a radius graph (if `eps` is given) or a k-NN graph from the edges of a :class:`NeighborIndex`, given their distances and ranks. Works on numpy arrays and tensors, e.g. the edge attributes of stored graphs.
+    """
+    if not eps is None:
+        return distances <= eps
+    return ranks < k
+
+class NeighborIndex():
+    """ The neighbors of every point up to a maximum radius and/or number of neighbors, sorted by distance.
+    Any radius graph with `eps <= r_max` or k-NN graph with `k <= k_max` can be sliced out of the index without a new neighbor search, see :meth:`select`.
+
+    Parameters
+    ----------
+    coords: ndarray
+        The coordinates, of shape (n, 3).
+    r_max: float, default None
+        The maximum radius.
+    k_max: int, default None
+        The maximum number of neighbors.
+    workers: int, default 1
+        The number of threads for the k-NN queries.
+    """
+
+    def __init__(self, coords, r_max=None, k_max=None, workers=1):
+        n = len(coords)
+        graphs = []
+        if not r_max is None:
+            graphs.append(radius_graph(coords, r_max, weighted=True).tocoo())
+        if not k_max is None:
+            graphs.append(knn_graph(coords, min(k_max, n - 1), weighted=True, workers=workers).tocoo())
+        rows = np.concatenate([g.row for g in graphs]).astype(np.int64)
+        cols = np.concatenate([g.col for g in graphs]).astype(np.int64)
+        distances = np.concatenate([g.data for g in graphs])
+        # remove the edges found by both searches, then sort the neighbors of every point by distance
+        _, unique = np.unique(rows * n + cols, return_index=True)
+        rows, cols, distances = rows[unique], cols[unique], distances[unique]
+        order = np.lexsort((cols, distances, rows))
+        self.n, self.r_max, self.k_max = n, r_max, k_max
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=n))]).astype(np.int64)
+        self.indices = cols[order]
+        self.distances = distances[order]
+
+    @property
+    def rows(self):
+        return np.repeat(np.arange(self.n), np.diff(self.indptr))
+
+    @property
+    def ranks(self):
+        """ The position of every neighbor in the sorted neighbor list of its point. """
+        return np.arange(len(self.indices)) - self.indptr[:-1][self.rows]
+
+    def edges(self):
+        """ The edges of the index in the order of a CSR adjacency matrix, i.e. sorted by source and target, so that sliced graphs have the same edge order as :func:`radius_graph` and :func:`knn_graph`.
+
+        Returns
+        -------
+        tuple
+            The sources, targets, distances and ranks of the edges.
+        """
+        rows, ranks = self.rows, self.ranks
+        order = np.lexsort((self.indices, rows))
+        return rows[order], self.indices[order], self.distances[order], ranks[order]
+
+    def select(self, eps=None, k=None, weighted=False):
+        """ Slices a graph out of the index, identical to :func:`radius_graph` or :func:`knn_graph`.
+
+        Parameters
+        ----------
+        eps: float, default None
+            The radius of the graph. Must not be larger than `r_max`.
+        k: int, default None
+            The number of neighbors of the graph, if `eps` is not given. Must not be larger than `k_max`.
+        weighted: bool, default False
+            If `True`, the values of the adjacency matrix are the euclidean distances. Otherwise they are 1.
+
+        Returns
+        -------
+        scipy.sparse.csr_matrix
+            The adjacency matrix of shape (n, n).
+        """
+        if not eps is None and (self.r_max is None or eps > self.r_max):
+            raise ValueError(f'eps={eps} is larger than r_max={self.r_max} of the neighbor index.')
+        if eps is None and (self.k_max is None or k > self.k_max):
+            raise ValueError(f'k={k} is larger than k_max={self.k_max} of the neighbor index.')
+        mask = neighbor_mask(self.distances, self.ranks, eps=eps, k=k)
+        values = self.distances[mask] if weighted else np.ones(mask.sum())
+        return csr_matrix((values, (self.rows[mask], self.indices[mask])), shape=(self.n, self.n))
@@ -0,0 +1,43 @@
+"""
+Reproducible random number streams for random transforms.
+The stream of an item only depends on the seed, the item and the epoch, not on the order of the items or the worker which processes them.
+"""
+
+import hashlib
+import numpy as np
+
+def item_key(protein):
+    """ A stable integer identifying a protein, derived from its ID (or its sequence if it has no ID).
+    Unlike `hash`, it is the same in every process and session.
+
+    Parameters
+    ----------
+    protein: dict
+        A protein dictionary.
+
+    Returns
+    -------
+    int
+        A 63 bit integer.
+    """
+    name = protein['protein']['ID'] if 'ID' in protein['protein'] else protein['protein']['sequence']
+    return int.from_bytes(hashlib.sha256(str(name).encode('utf-8')).digest()[:8], 'little') >> 1
+
+def item_rng(seed, key, epoch=0):
+    """ Creates the random number generator of an item.
+
+    Parameters
+    ----------
+    seed: int
+        The seed of the transform.
+    key: int
+        The item, e.g. from :func:`item_key` or the index of the item in the dataset.
+    epoch: int, default 0
+        The epoch, to draw new random numbers in every epoch.
+
+    Returns
+    -------
+    np.random.Generator
+        The random number generator.
+    """
+    return np.random.default_rng(np.random.SeedSequence([int(seed), int(key), int(epoch)]))
@@ -9,7 +9,7 @@ install_requires = [
     'rdkit>=2024.9.6',
     'tqdm>=4.64.0',
     'scikit-learn>=1.1.1',
-    'joblib>=1.2.0',
+    'joblib>=1.3.0',
     'requests>=2.27.1',
     'fastavro>=1.6.1',
     'freesasa>=2.2.0.post3',
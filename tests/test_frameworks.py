@@ -23,13 +23,36 @@ class TestFrameworks(unittest.TestCase):
         loader = DataLoader(graphs)
         x = next(iter(loader))
 
+    def test_graph_pyg_collated(self):
+        import torch
+        from torch_geometric.loader import DataLoader
+        graphs = self.ds.to_graph(k=5).pyg()
+        collated = self.ds.to_graph(k=5).pyg(storage='collated')
+        for (a, _), (b, _) in zip(graphs, collated):
+            assert torch.equal(a.x, b.x) and torch.equal(a.edge_index, b.edge_index) and torch.equal(a.edge_attr, b.edge_attr)
+        loader = DataLoader(collated, batch_size=4)
+        x = next(iter(loader))
+
     def test_graph_dgl(self):
         from dgl.dataloading import GraphDataLoader as DataLoader
         graphs = self.ds.to_graph(k=5).dgl()
         loader = DataLoader(graphs)
         x = next(iter(loader))
 
-    def test_graph_nx(self):
+    def test_graph_dgl_batched(self):
+        from dgl.dataloading import GraphDataLoader as DataLoader
+        graphs = self.ds.to_graph(k=5).dgl(storage='batched')
+        assert graphs[[2, 0]][1][0].num_nodes() == graphs[0][0].num_nodes()
+        loader = DataLoader(graphs)
+        x = next(iter(loader))
+
+    def test_graph_dgl_cached(self):
+        # load-time encodings must not be written into the cached graphs
+        graphs = self.ds.to_graph(eps=8, edge_rbf=10).dgl(cache_size=2**30)
+        first, _ = graphs[0]
+        second, _ = graphs[0]
+        assert first is not second and first.edata['edge_rbf'].shape == (first.num_edges(), 10)
+        assert not 'edge_rbf' in graphs.cache.get(0)[0].edata
         graphs = self.ds.to_graph(k=5).nx()
         x = graphs[0]
 
@@ -39,6 +62,17 @@ class TestFrameworks(unittest.TestCase):
         loader = DataLoader(voxels)
         x = next(iter(loader))
 
+    def test_voxel_torch_sparse(self):
+        import torch
+        from torch.utils.data import DataLoader
+        voxels = self.ds.to_voxel().torch()
+        sparse = self.ds.to_voxel().torch(sparse=True)
+        coords, features = sparse[0][0]
+        assert coords.shape[1] == 3 and features.shape[1] == 20
+        loader = DataLoader(sparse, batch_size=2, collate_fn=sparse.collate)
+        x, protein_dicts = next(iter(loader))
+        assert torch.equal(x.to_dense()[1], voxels[1][0])
+
     def test_voxel_tf(self):
         import tensorflow as tf
         voxels = self.ds.to_voxel().tf()
@@ -48,6 +82,23 @@ class TestFrameworks(unittest.TestCase):
         loader = tf.data.Dataset.from_generator(generator, output_signature=tf.TensorSpec(shape=None, dtype=tf.float32))
         x = next(iter(loader))
 
+    def test_voxel_tf_data(self):
+        import numpy as np
+        import tensorflow as tf
+        voxels = self.ds.to_voxel().tf()
+        records = self.ds.to_voxel().tf(storage='tfrecord')
+        assert np.allclose(records[1][0].numpy(), voxels[1][0].numpy())
+        loader = records.to_tf_data().batch(2).prefetch(tf.data.AUTOTUNE)
+        x, index = next(iter(loader))
+        assert np.allclose(x[1].numpy(), voxels[int(index[1])][0].numpy())
+
+    def test_point_tf_data(self):
+        import tensorflow as tf
+        points = self.ds.to_point().tf(storage='tfrecord')
+        loader = points.to_tf_data(deterministic=False)
+        x, index = next(iter(loader))
+        assert x.shape == points[int(index)][0].shape
+
     def test_voxel_np(self):
         import numpy as np
         points = self.ds.to_point().np()
@@ -57,12 +108,41 @@ class TestFrameworks(unittest.TestCase):
         loader = np.fromiter(generator(), object)
         x = next(iter(loader))
 
+    def test_voxel_np_collated(self):
+        import numpy as np
+        from proteinshake.frameworks.np import densify
+        voxels = self.ds.to_voxel().np()
+        stacked = self.ds.to_voxel().np(storage='collated')
+        sparse = self.ds.to_voxel().np(storage='sparse')
+        assert np.allclose(stacked[2][0], voxels[2][0])
+        coords, features = sparse[2][0]
+        assert np.allclose(densify(coords, features, voxels[2][0].shape[:-1]), voxels[2][0])
+
+    def test_point_np_collated(self):
+        import numpy as np
+        points = self.ds.to_point().np()
+        collated = self.ds.to_point().np(storage='collated')
+        assert all(np.allclose(a[0], b[0]) for a, b in zip(points, collated))
+        assert collated[0][0].base is not None # a view into the memory map
+
     def test_point_torch(self):
         from torch.utils.data import DataLoader
         points = self.ds.to_point().torch()
         loader = DataLoader(points)
         x = next(iter(loader))
 
+    def test_torch_collated(self):
+        import torch
+        from torch.utils.data import DataLoader
+        voxels = self.ds.to_voxel().torch()
+        collated_voxels = self.ds.to_voxel().torch(storage='collated')
+        assert torch.equal(voxels[3][0], collated_voxels[3][0])
+        points = self.ds.to_point().torch()
+        collated_points = self.ds.to_point().torch(storage='collated')
+        assert torch.equal(points[3][0], collated_points[3][0])
+        loader = DataLoader(collated_points)
+        x = next(iter(loader))
+
     def test_point_tf(self):
         import tensorflow as tf
         points = self.ds.to_point().tf()
@@ -81,6 +161,218 @@ class TestFrameworks(unittest.TestCase):
         loader = np.fromiter(generator(), object)
         x = next(iter(loader))
 
+    def test_packed_storage(self):
+        import numpy as np
+        points = self.ds.to_point().np()
+        packed = self.ds.to_point().np(storage='packed', compression='zlib')
+        assert len(packed) == len(points)
+        assert np.allclose(packed[1][0], points[1][0])
+        mapped = self.ds.to_point().np(storage='packed', compression='zlib', use_mmap=True)
+        assert np.allclose(mapped[1][0], points[1][0])
+
+    def test_parallel_conversion(self):
+        import numpy as np
+        points = self.ds.to_point().np()
+        parallel = self.ds.to_point().np(n_jobs=2, storage='packed')
+        assert len(parallel) == len(points)
+        assert all(np.allclose(a[0], b[0]) for a, b in zip(parallel, points))
+
+    def test_protein_pre_filter(self):
+        ID = next(self.ds.proteins())['protein']['ID']
+        graphs = self.ds.to_graph(k=5).nx(pre_filter=lambda protein_dict: protein_dict['protein']['ID'] != ID, storage='packed')
+        assert len(graphs) == len(self.ds.proteins()) - 1
+
+    def test_item_cache(self):
+        voxels = self.ds.to_voxel().np(cache_size=2**30, cache_stage='transformed')
+        for epoch in range(2):
+            for data, protein_dict in voxels:
+                pass
+        info = voxels.cache_info()
+        assert info['misses'] == len(voxels) and info['hits'] == len(voxels)
+        small = self.ds.to_voxel().np(cache_size=1)
+        small[0]
+        assert small.cache_info()['items'] == 0
+
+    def test_batched_reads(self):
+        import numpy as np
+        points = self.ds.to_point().np()
+        packed = self.ds.to_point().np(storage='packed', compression='zlib', cache_size=2**30)
+        indices = np.array([3, 0, 3, 1])
+        for a, b in zip(packed[indices], points[indices]):
+            assert np.allclose(a[0], b[0])
+        for a, b in zip(packed[indices], [points[int(i)] for i in indices]):
+            assert np.allclose(a[0], b[0])
+
+    def test_cache_keys(self):
+        from proteinshake.transforms import CenterTransform
+        from proteinshake.utils import stable_hash
+        assert stable_hash(CenterTransform()) == stable_hash(CenterTransform())
+        assert stable_hash(CenterTransform()) != stable_hash(CenterTransform(resolution='atom'))
+        assert stable_hash(lambda x: x + 1) != stable_hash(lambda x: x + 2)
+        assert self.ds.to_point().path != self.ds.to_point(transform=CenterTransform()).path
+        assert self.ds.to_graph(k=5).path == self.ds.to_graph(k=5).path
+        points = self.ds.to_point().np()
+        filtered = self.ds.to_point().np(pre_filter=lambda protein_dict: protein_dict['protein']['ID'] != points[0][1]['protein']['ID'])
+        assert len(filtered) == len(points) - 1 and filtered.path != points.path
+
+    def test_disk_budget(self):
+        import os
+        from proteinshake.utils import CacheManager
+        from proteinshake.utils.cache import parse_size
+        assert parse_size('2K') == 2048 and parse_size('1.5G') == int(1.5 * 2**30)
+        old = self.ds.to_point().np(storage='packed')
+        new = self.ds.to_graph(k=3).nx(storage='packed')
+        cache = CacheManager(f'{self.ds.root}/processed')
+        paths = [entry['path'] for entry in cache.list()]
+        assert paths.index(old.path) < paths.index(new.path)
+        removed = cache.prune(0, keep=[new.path])
+        assert old.path in [entry['path'] for entry in removed] and not new.path in [entry['path'] for entry in removed]
+        assert not os.path.exists(old.path) and os.path.exists(new.path)
+        path = new.path
+        del old, new
+        self.ds.to_graph(k=4).nx(disk_budget=0)
+        assert not os.path.exists(path)
+
+    def test_disk_budget_open_datasets(self):
+        import numpy as np
+        points = self.ds.to_point().np(storage='packed')
+        reference = points[1][0]
+        self.ds.to_graph(k=6).nx(disk_budget=0)
+        assert np.allclose(points[1][0], reference)
+
+    def test_voxel_aggregation(self):
+        import numpy as np
+        from proteinshake.representations.voxel import Voxel
+        protein = next(iter(self.ds.proteins()))
+        n = len(protein['residue']['residue_type'])
+        gridsize = np.array([100, 100, 100])
+        summed = Voxel(protein, gridsize, 3, 'sum').data
+        mean = Voxel(protein, gridsize, 3, 'mean').data
+        assert summed.sum() == n
+        assert np.allclose(mean.sum(-1)[summed.sum(-1) > 0], 1)
+        assert np.allclose(mean * summed.sum(-1, keepdims=True), summed)
+
+    def test_voxel_gridsize(self):
+        import glob
+        import numpy as np
+        first = self.ds.to_voxel(voxelsize=7)
+        assert len(glob.glob(f'{self.ds.root}/processed/voxel/*.extents.npy')) > 0
+        second = self.ds.to_voxel(voxelsize=7)
+        assert np.array_equal(first.gridsize, second.gridsize) and first.path == second.path
+        assert len(list(second.voxels)) == len(self.ds.proteins())
+
+    def test_neighbors(self):
+        import numpy as np
+        from sklearn.neighbors import radius_neighbors_graph, kneighbors_graph
+        from proteinshake.utils.neighbors import radius_graph, knn_graph
+        protein = next(iter(self.ds.proteins()))
+        coords = np.stack([protein['residue'][c] for c in 'xyz'], axis=1)
+        assert abs(radius_graph(coords, 8, weighted=True) - radius_neighbors_graph(coords, 8, mode='distance')).max() < 1e-9
+        assert (knn_graph(coords, 5) != kneighbors_graph(coords, 5)).nnz == 0
+
+    def test_neighbor_index(self):
+        import torch
+        import networkx as nx
+        index = self.ds.to_graph(eps=6, r_max=10, k_max=8)
+        assert index.path == self.ds.to_graph(eps=8, weighted_edges=True, r_max=10, k_max=8).path
+        for kwargs in [{'eps': 6}, {'eps': 10, 'weighted_edges': True}, {'k': 5}]:
+            sliced = self.ds.to_graph(r_max=10, k_max=8, **kwargs).pyg()
+            direct = self.ds.to_graph(**kwargs).pyg()
+            dense = lambda data: torch.sparse_coo_tensor(data.edge_index, data.edge_attr[:,0], (data.num_nodes,) * 2).to_dense()
+            for (a, _), (b, _) in zip(sliced, direct):
+                assert a.num_edges == b.num_edges and torch.allclose(dense(a), dense(b))
+        sliced, direct = self.ds.to_graph(k=3, k_max=8).nx(), self.ds.to_graph(k=3).nx()
+        assert all(nx.utils.graphs_equal(a, b) for (a, _), (b, _) in zip(sliced, direct))
+        with self.assertRaises(Exception):
+            self.ds.to_graph(eps=12, r_max=10)
+
+    def test_neighbor_index_sizes(self):
+        import numpy as np
+        from proteinshake.frameworks.sampler import DynamicBatchSampler
+        for eps in [6, 8]:
+            sliced = self.ds.to_graph(eps=eps, r_max=10).pyg()
+            direct = self.ds.to_graph(eps=eps).pyg()
+            assert np.array_equal(sliced.sizes['edges'], direct.sizes['edges'])
+            budget = int(np.sort(sliced.sizes['edges'])[-3:].sum())
+            batches = list(DynamicBatchSampler(sliced, max_size=budget, key='edges', bucket_size=4))
+            assert any(len(batch) > 1 for batch in batches)
+            for batch in batches:
+                assert len(batch) == 1 or sum(sliced[int(i)][0].num_edges for i in batch) <= budget
+        graphs = self.ds.to_graph(k=3, k_max=8).nx()
+        assert list(graphs.sizes['edges'][:3]) == [graphs[i][0].number_of_edges() for i in range(3)]
+
+    def test_graph_on_the_fly(self):
+        import torch
+        from torch.utils.data import DataLoader
+        for kwargs in [{'eps': 8, 'weighted_edges': True}, {'k': 5}]:
+            lazy = self.ds.to_graph(on_the_fly=True, **kwargs).pyg()
+            stored = self.ds.to_graph(**kwargs).pyg()
+            data, _ = lazy[0]
+            assert data.num_edges > 0 and torch.equal(data.edge_index, stored[0][0].edge_index)
+            assert [item[0].num_edges for item in lazy[[1, 2]]] == [stored[1][0].num_edges, stored[2][0].num_edges]
+            batch, protein_dicts = next(iter(DataLoader(lazy, batch_size=4, collate_fn=lazy.collate)))
+            expected, _ = stored.collate([stored[i] for i in range(4)])
+            assert batch.num_graphs == len(protein_dicts) == 4
+            assert torch.equal(batch.edge_index, expected.edge_index) and torch.allclose(batch.edge_attr, expected.edge_attr)
+
+    def test_graph_encodings(self):
+        import numpy as np
+        from torch_geometric.loader import DataLoader
+        from proteinshake.utils import random_walk_encoding, rbf_encoding
+        from proteinshake.utils.neighbors import radius_graph
+        graphs = self.ds.to_graph(eps=8, laplacian_pe=4, random_walk_pe=6, edge_rbf=10).pyg(storage='collated')
+        data, protein_dict = graphs[1]
+        n = data.num_nodes
+        assert data.laplacian_eigenvector_pe.shape == (n, 4) and data.random_walk_pe.shape == (n, 6) and data.edge_rbf.shape == (data.num_edges, 10)
+        coords = np.stack([protein_dict['residue'][c] for c in 'xyz'], axis=1)
+        adj = radius_graph(coords, 8, weighted=True)
+        assert np.allclose(data.random_walk_pe.numpy(), random_walk_encoding(adj, 6), atol=1e-3)
+        assert np.allclose(data.edge_rbf.numpy(), rbf_encoding(adj.data, 10, 8), atol=1e-5)
+        batch, _ = next(iter(DataLoader(graphs, batch_size=4)))
+        assert batch.laplacian_eigenvector_pe.shape == (batch.num_nodes, 4)
+        with self.assertRaises(Exception):
+            self.ds.to_graph(k=5, edge_rbf=10)
+        with self.assertRaises(Exception):
+            self.ds.to_graph(resolution='atom', k=5, random_walk_pe=4)
+        with self.assertRaises(Exception):
+            self.ds.to_graph(eps=8, laplacian_pe=0)
+        for kwargs in [{'eps': 8}, {'k': 5}, {'eps': 8, 'edge_rbf': 4}, {'eps': 6, 'r_max': 10}, {'eps': 8, 'on_the_fly': True}]:
+            assert os.path.basename(self.ds.to_graph(**kwargs).path).startswith(f'{self.ds.name}_residue_')
+
+    def test_prefetch(self):
+        import numpy as np
+        points = self.ds.to_point().np(storage='packed')
+        items = list(points.prefetch(depth=2, chunk_size=2))
+        assert len(items) == len(points)
+        for a, b in zip(items, points):
+            assert np.allclose(a[0], b[0])
+        subset = points.prefetch(indices=[3, 1], backend='process', n_workers=1)
+        assert [np.allclose(a[0], points[i][0]) for a, i in zip(subset, [3, 1])] == [True, True]
+        unordered = list(points.prefetch(ordered=False))
+        assert sorted(p['protein']['ID'] for _, p in unordered) == sorted(p['protein']['ID'] for _, p in points)
+
+    def test_dynamic_batches(self):
+        from torch_geometric.loader import DataLoader
+        from proteinshake.frameworks.sampler import DynamicBatchSampler
+        graphs = self.ds.to_graph(k=5).pyg(storage='packed')
+        sampler = DynamicBatchSampler(graphs, max_size=1000, bucket_size=4)
+        batches = list(sampler)
+        assert sorted(i for batch in batches for i in batch) == list(range(len(graphs)))
+        assert all(len(batch) == 1 or graphs.sizes['nodes'][batch].sum() <= 1000 for batch in batches)
+        assert len(graphs.sizes['edges']) == len(graphs)
+        loader = DataLoader(graphs, batch_sampler=sampler)
+        x = next(iter(loader))
+
+    def test_subset(self):
+        from proteinshake.frameworks.dataset import Subset
+        points = self.ds.to_point().np()
+        subset = Subset(points, [2, 0, 1])
+        assert len(subset) == 3
+        assert subset[0][1]['protein']['ID'] == points[2][1]['protein']['ID']
+        assert len(subset[1:]) == 2
+        assert subset[[2]][0][1]['protein']['ID'] == points[1][1]['protein']['ID']
+        assert len(list(subset)) == 3
+
 
 if __name__ == '__main__':
     unittest.main()
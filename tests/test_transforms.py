@@ -27,3 +27,57 @@ class TestTransforms(unittest.TestCase):
 
     def test_compose(self):
         self.ds.to_voxel(transform=Compose([CenterTransform(), RandomRotateTransform()]))
+
+    def test_array_coords(self):
+        import copy
+        import numpy as np
+        protein = next(iter(self.ds.proteins()))
+        fused, sequential = copy.deepcopy(protein), copy.deepcopy(protein)
+        Compose([CenterTransform(), RandomRotateTransform(seed=0)])(fused)
+        RandomRotateTransform(seed=0)(CenterTransform()(sequential))
+        for c in 'xyz':
+            assert np.allclose(fused['residue'][c], sequential['residue'][c])
+        assert fused['residue']['x'].base is fused['residue']['y'].base
+        assert np.allclose(np.mean([fused['residue'][c] for c in 'xyz'], axis=1), 0)
+
+    def test_batch(self):
+        import copy
+        import numpy as np
+        from proteinshake.transforms import pack_coords
+        from proteinshake.utils import item_key
+        proteins = list(self.ds.proteins())
+        batched, sequential = copy.deepcopy(proteins), copy.deepcopy(proteins)
+        transform = Compose([CenterTransform(), RandomRotateTransform()])
+        coords, ptr = pack_coords(batched)
+        transform.batch(coords, ptr, keys=[item_key(protein) for protein in batched])
+        for protein in sequential:
+            transform(protein)
+        for a, b in zip(batched, sequential):
+            assert np.allclose(a['residue']['x'], b['residue']['x'])
+
+    def test_reproducible_rotation(self):
+        import copy
+        import numpy as np
+        from joblib import Parallel, delayed
+        proteins = list(self.ds.proteins())[:4]
+        rotate = RandomRotateTransform(seed=1)
+        serial = [rotate(copy.deepcopy(p))['residue']['x'] for p in proteins]
+        parallel = Parallel(n_jobs=2)(delayed(rotate)(copy.deepcopy(p)) for p in proteins[::-1])[::-1]
+        for a, b in zip(serial, parallel):
+            assert np.allclose(a, b['residue']['x'])
+        rotate.set_epoch(1)
+        assert not np.allclose(serial[0], rotate(copy.deepcopy(proteins[0]))['residue']['x'])
+
+    def test_batch_rotation_workers(self):
+        import pickle
+        import numpy as np
+        rotate = RandomRotateTransform(seed=3)
+        workers = [pickle.loads(pickle.dumps(rotate)) for _ in range(2)]
+        centers = np.zeros((2, 3))
+        A, _ = workers[0].affine_batch(centers, keys=[1, 2])
+        B, _ = workers[1].affine_batch(centers, keys=[3, 4])
+        assert not np.allclose(A, B)
+        C, _ = workers[1].affine_batch(centers, keys=[1, 2])
+        assert np.allclose(A, C)
+        with self.assertRaises(ValueError):
+            workers[0].affine_batch(centers)
@@ -0,0 +1,65 @@
+'''
+Tests the embeddings and encodings in proteinshake.utils.
+'''
+import unittest
+import numpy as np
+
+from proteinshake.utils import tokenize, onehot, positional_encoding
+from proteinshake.utils.embeddings import residue_alphabet, atom_alphabet
+
+
+class TestEmbeddings(unittest.TestCase):
+
+    residues = list('MKTAYIAKQRQISFVKSHFSRQLEERLGLIEVQAPILSRVGDGTQDNLSGAEKAVQVKVKALPDAQFEVVHSLAKWKRQTLGQHDFSAGEGLYTHMKALRPDEDRLSPLHSVYVDQWDWERVMGDGERQFSTLKSTVEAIWAGIKATEAAVSEEFGLAPFLPDQIHFVHSQELLSRYPDLDAKGRERAIAKDLGAVFLVGIGGKLSDGHRHDVRAPDYDDWSTPSELGHAGLNGDILVWNPVLEDAFELSSMGIRVDADTLKHQLALTGDEDRLELEWHQALLRGEMPQTIGGGIGQSRLTMLLLQLPHIGQVQAGVWPAACRESVPALL')
+    atoms = ['N', 'CA', 'C', 'O', 'CB', 'OG1', 'SD', 'NZ', 'SG', 'OXT', 'H']
+
+    def test_tokenize(self):
+        assert np.array_equal(tokenize(self.residues), [residue_alphabet.index(aa) for aa in self.residues])
+        assert np.array_equal(tokenize(self.atoms, resolution='atom'), [atom_alphabet.index(atom[0]) for atom in self.atoms])
+        assert len(tokenize([])) == 0
+
+    def test_onehot(self):
+        assert np.array_equal(onehot(self.residues), np.eye(len(residue_alphabet))[[residue_alphabet.index(aa) for aa in self.residues]])
+        assert np.array_equal(onehot(self.atoms, resolution='atom'), np.eye(len(atom_alphabet))[[atom_alphabet.index(atom[0]) for atom in self.atoms]])
+
+    def test_unknown_residue(self):
+        with self.assertRaises(ValueError):
+            tokenize(list('ACDXE'))
+        with self.assertRaises(ValueError):
+            onehot(list('ACDBE'))
+        with self.assertRaises(ValueError):
+            tokenize(['CA', 'ZN'], resolution='atom')
+
+    def test_positional_encoding(self):
+        dim = 16
+        angles = np.array([[position / np.power(10000, 2 * (i // 2) / dim) for i in range(dim)] for position in range(len(self.residues))])
+        reference = np.where(np.arange(dim) % 2 == 0, np.sin(angles), np.cos(angles))
+        assert np.allclose(positional_encoding(self.residues, dim=dim), reference)
+        # longer sequences grow the cached table, and the returned encodings are copies
+        long = positional_encoding(self.residues * 4, dim=dim)
+        assert np.allclose(long[:len(self.residues)], reference)
+        long[:] = 0
+        assert np.allclose(positional_encoding(self.residues, dim=dim), reference)
+
+
+class TestEncodings(unittest.TestCase):
+
+    def test_sparse_encodings(self):
+        from proteinshake.utils import laplacian_encoding, random_walk_encoding
+        from proteinshake.utils.neighbors import radius_graph
+        coords = np.random.default_rng(0).uniform(-6, 6, size=(300, 3)) # dense enough to be connected, so the eigenvectors are unique
+        adj = radius_graph(coords, 4)
+        A = adj.toarray()
+        degree = A.sum(axis=1)
+        # dense references
+        scale = np.divide(1, np.sqrt(degree), out=np.zeros(len(degree)), where=degree > 0)
+        _, vectors = np.linalg.eigh(np.eye(len(A)) - scale[:,None] * A * scale[None,:])
+        vectors = vectors[:,1:5]
+        vectors *= np.sign(vectors[np.abs(vectors).argmax(axis=0), np.arange(4)])
+        assert np.allclose(laplacian_encoding(adj, 4), vectors, atol=1e-6)
+        walk = np.divide(1, degree, out=np.zeros(len(degree)), where=degree > 0)[:,None] * A
+        power, returns = np.eye(len(A)), []
+        for _ in range(6):
+            power = power @ walk
+            returns.append(power.diagonal())
+        assert np.allclose(random_walk_encoding(adj, 6, block_size=64), np.stack(returns, axis=1), atol=1e-5)